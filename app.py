@@ -1,70 +1,208 @@
+import time
+
+# Partida: as importações abaixo só pesam na primeira execução do processo (depois vêm do cache de
+# módulos). Os módulos pesados (scikit-learn, joblib) são importados só quando usados
+inicio_importacoes = time.perf_counter()
 import streamlit as st
 import pandas as pd
-from utils.graficos import (
-    gerar_grafico_rosca, gerar_grafico_barra,
-    gerar_piramide_etaria, gerar_grafico_violino
+from utils.aquecimento import aquecer, opcoes_regiao
+from utils.graficos import gerar_piramide_etaria
+from utils.comparacao import CACHE_COMPARACOES
+from utils.instrumentacao import (
+    ATIVA_POR_PADRAO, PARTIDA, finalizar_coleta, iniciar_coleta, medir, rastrear_memoria, registrar_partida
+)
+from utils.painel import (
+    CACHE_TAREFAS, LEGENDA_REGIOES, chave_comparacao, chave_regioes, chave_resumo, chave_violino,
+    iniciar_painel, montar_comparacao, montar_regioes, montar_resumo, montar_violino, resultado
 )
-from utils.processamento import carregar_dados
+from utils.predicao import carregar_modelo, ler_metricas_modelo, prever_csv, resumir_previsoes_recorte
+from utils.processamento import LEGENDA_MEDIDAS, consultar_percentil, edicoes_disponiveis
+registrar_partida(importacoes_ms=round((time.perf_counter() - inicio_importacoes) * 1000, 3))
 
-df = carregar_dados()
+# Instrumentação: ligada pelo painel de desempenho (fim da barra lateral) ou por ENEM_INSTRUMENTACAO=1
+inicio_execucao = time.perf_counter()
+depuracao = st.session_state.get('depuracao', False)
+if depuracao or ATIVA_POR_PADRAO:
+    iniciar_coleta()
+if depuracao:
+    rastrear_memoria(st.session_state.get('depuracao_memoria', False))
+
+# Envia uma figura ao navegador; com a instrumentação ligada, registra o tamanho do JSON da figura
+def exibir_grafico(figura, nome):
+    with medir('plotly_chart', figura=nome) as registro:
+        if registro is not None:
+            registro['bytes'] = len(figura.to_json())
+        st.plotly_chart(figura, use_container_width=True)
 
 # Filtros
 st.sidebar.header("Filtros")
+ano = st.sidebar.selectbox("Edição do ENEM", edicoes_disponiveis())
+with medir('opcoes_regiao'):
+    ufs, municipios_por_uf = opcoes_regiao(ano)
 sexo = st.sidebar.selectbox("Sexo", ['Todos', 'Masculino', 'Feminino'])
 escola = st.sidebar.selectbox("Tipo de Escola", ['Todos', 'Pública', 'Privada'])
-ufs = ['Todos'] + sorted(df['SG_UF_ESC'].unique())
-estado = st.sidebar.selectbox("Estado da Escola", ufs)
-municipios_filtrados = sorted(df[df['SG_UF_ESC'] == estado]['NO_MUNICIPIO_ESC'].unique()) if estado != 'Todos' else sorted(df['NO_MUNICIPIO_ESC'].unique())
-municipio = st.sidebar.selectbox("Município da Escola", ['Todos'] + municipios_filtrados)
-
-# Aplicar filtros
-df_filtrado = df.copy()
-if sexo != 'Todos':
-    df_filtrado = df_filtrado[df_filtrado['TP_SEXO'] == sexo]
-if escola != 'Todos':
-    df_filtrado = df_filtrado[df_filtrado['TP_ESCOLA'] == escola]
-if estado != 'Todos':
-    df_filtrado = df_filtrado[df_filtrado['SG_UF_ESC'] == estado]
-if municipio != 'Todos':
-    df_filtrado = df_filtrado[df_filtrado['NO_MUNICIPIO_ESC'] == municipio]
+estado = st.sidebar.selectbox("Estado da Escola", ['Todos'] + ufs)
+municipio = st.sidebar.selectbox("Município da Escola", ['Todos'] + municipios_por_uf[estado])
+
+# Todas as tarefas do recorte começam já, em paralelo; cada bloco abaixo espera só pela sua. As da
+# visão padrão vêm prontas do artefato de aquecimento, quando ele existe (python -m utils.aquecimento)
+with medir('aquecimento'):
+    aquecer(ano)
+iniciar_painel(ano, sexo, escola, estado, municipio, st.session_state.get('medida_regiao', 'MEDIA_NOTAS'))
 
 # Título
-st.markdown("""
+st.markdown(f"""
 <div style='text-align: center;'>
     <h1>A ESCOLA CONTA?</h1>
-    <h4>ANÁLISE DE NOTAS DO ENEM 2023</h4>
+    <h4>ANÁLISE DE NOTAS DO ENEM {ano}</h4>
     <h4>ANÁLISE DE DADOS E MACHINE LEARNING NA INVESTIGAÇÃO DO DESEMPENHO EDUCACIONAL</h4>
 </div>
 """, unsafe_allow_html=True)
 
-# Gráficos
-st.plotly_chart(gerar_piramide_etaria(df_filtrado), use_container_width=True)
-
-# Roscas
-from utils.processamento import filtrar_dependencia
-fig_escola = gerar_grafico_rosca(df_filtrado, 'TP_ESCOLA', 'TP_ESCOLA', 'Tipo de Escola')
-fig_dependencia = gerar_grafico_rosca(filtrar_dependencia(df_filtrado, escola), 'TP_DEPENDENCIA_ADM_ESC', 'TP_DEPENDENCIA_ADM_ESC', 'Dependência Administrativa')
-
-col1, col2 = st.columns(2)
-with col1:
-    st.plotly_chart(fig_escola, use_container_width=True)
-with col2:
-    st.plotly_chart(fig_dependencia, use_container_width=True)
-
-# Médias por disciplina
-from utils.processamento import preparar_media_disciplinas
-media_long = preparar_media_disciplinas(df_filtrado)
-fig_disciplinas = gerar_grafico_barra(
-    media_long, 'Disciplina', 'Média', 'TP_ESCOLA',
-    'Média por Disciplina e Tipo de Escola',
-    {'TP_ESCOLA': 'Tipo de Escola'}
-)
-st.plotly_chart(fig_disciplinas, use_container_width=True)
+# Cada bloco é um fragmento: um widget dentro dele executa de novo só aquele bloco
+
+# Pirâmide
+@st.fragment
+def bloco_piramide(ano, sexo, escola, estado, municipio):
+    empilhar_escola = st.checkbox("Separar a pirâmide por tipo de escola", key='empilhar_escola')
+    with st.spinner("Carregando a pirâmide etária..."):
+        resumo = resultado(chave_resumo(ano, sexo, escola, estado, municipio), montar_resumo,
+                           ano, sexo, escola, estado, municipio)
+    exibir_grafico(
+        gerar_piramide_etaria(resumo['piramide'], 'TP_ESCOLA' if empilhar_escola else None), 'piramide'
+    )
+
+# Roscas e médias por disciplina
+@st.fragment
+def bloco_resumo(ano, sexo, escola, estado, municipio):
+    resumo = resultado(chave_resumo(ano, sexo, escola, estado, municipio), montar_resumo,
+                       ano, sexo, escola, estado, municipio)
+    col1, col2 = st.columns(2)
+    with col1:
+        exibir_grafico(resumo['escola'], 'escola')
+    with col2:
+        exibir_grafico(resumo['dependencia'], 'dependencia')
+    exibir_grafico(resumo['disciplinas'], 'disciplinas')
 
 # Violino
-fig_violino = gerar_grafico_violino(
-    df, 'TP_ESCOLA', 'MEDIA_NOTAS',
-    'Distribuição da Média das Provas por Tipo de Escola (Gráfico Violino)',
-    {'TP_ESCOLA': 'Tipo de Escola', 'MEDIA_NOTAS': 'Média das Notas'}
+@st.fragment
+def bloco_violino(ano, sexo, escola, estado, municipio):
+    with st.spinner("Calculando a distribuição das notas..."):
+        figura = resultado(chave_violino(ano, sexo, escola, estado, municipio), montar_violino,
+                           ano, sexo, escola, estado, municipio)
+    exibir_grafico(figura, 'violino')
+
+# Percentil de uma nota no recorte (índice de histogramas gravado com a edição, sem ler as linhas)
+@st.fragment
+def bloco_percentil(ano, sexo, escola, estado, municipio):
+    st.subheader("Em que percentil está uma nota?")
+    col1, col2 = st.columns(2)
+    with col1:
+        medida_percentil = st.selectbox("Prova", list(LEGENDA_MEDIDAS), format_func=LEGENDA_MEDIDAS.get)
+    with col2:
+        nota_percentil = st.number_input("Nota", min_value=0.0, max_value=1000.0, value=650.0, step=10.0)
+    with medir('percentil'):
+        consulta = consultar_percentil(ano, medida_percentil, nota_percentil, sexo, escola, estado, municipio)
+    if consulta['quantidade']:
+        st.metric(
+            f"Percentil de {nota_percentil:.1f} em {LEGENDA_MEDIDAS[medida_percentil]}",
+            f"{consulta['percentil']:.1f}%"
+        )
+        st.caption(
+            f"{consulta['quantidade']} participantes no recorte. "
+            + " · ".join(f"P{quantil * 100:.0f}: {valor:.1f}" for quantil, valor in consulta['quantis'].items())
+        )
+    else:
+        st.info("Nenhum participante no recorte selecionado.")
+
+# Comparação Pública x Privada no recorte (o filtro de tipo de escola não se aplica)
+@st.fragment
+def bloco_comparacao(ano, sexo, estado, municipio):
+    st.subheader("A escola conta? Diferença entre escolas privadas e públicas")
+    with st.spinner("Calculando os intervalos de confiança..."):
+        comparacao, figura = resultado(chave_comparacao(ano, sexo, estado, municipio), montar_comparacao,
+                                       ano, sexo, estado, municipio)
+    exibir_grafico(figura, 'comparacao')
+    st.dataframe(
+        comparacao.drop(columns='Medida').set_index('Disciplina').round(2),
+        use_container_width=True
+    )
+
+# Ranking geográfico (tabela por região gravada com a edição; os filtros de sexo e escola não se aplicam)
+@st.fragment
+def bloco_regioes(ano, estado):
+    st.subheader("Desempenho por região")
+    medida_regiao = st.radio(
+        "Ordenar regiões por", ['MEDIA_NOTAS', 'QUANTIDADE', 'DIFERENCA_ESCOLAS'],
+        format_func=LEGENDA_REGIOES.get, horizontal=True, key='medida_regiao'
+    )
+    figura = resultado(chave_regioes(ano, estado, medida_regiao), montar_regioes, ano, estado, medida_regiao)
+    exibir_grafico(figura, 'regioes')
+
+# Previsão das notas pelo perfil do participante (modelo treinado fora do app: python -m utils.predicao)
+@st.fragment
+def bloco_predicao(ano, sexo, escola, estado, municipio):
+    st.subheader("Previsão de notas pelo perfil do participante")
+    metricas = ler_metricas_modelo(ano)
+    if metricas is None:
+        st.info(f"Modelo da edição {ano} ainda não treinado. Rode: python -m utils.predicao {ano}")
+        return
+    st.caption(
+        "R² de validação: "
+        + " · ".join(f"{LEGENDA_MEDIDAS[medida]}: {valor:.2f}" for medida, valor in metricas['r2_validacao'].items())
+    )
+    # O modelo (e o scikit-learn) só é carregado quando uma previsão é pedida
+    if st.button("Comparar previsões e notas do recorte"):
+        with st.spinner("Calculando previsões..."), medir('predicao_recorte'):
+            resumo = resumir_previsoes_recorte(carregar_modelo(ano), ano, sexo, escola, estado, municipio)
+        st.dataframe(resumo.set_index('Disciplina').round(1), use_container_width=True)
+    arquivo = st.file_uploader("Prever notas de um CSV no formato do INEP (separado por ';')", type='csv')
+    if arquivo is not None:
+        try:
+            with st.spinner("Calculando previsões..."), medir('predicao_csv'):
+                blocos = list(prever_csv(carregar_modelo(ano), arquivo))
+        except ValueError as erro:
+            # Colunas de atributos ausentes ou valores que não são códigos do INEP
+            st.error(f"Não foi possível ler o CSV enviado: {erro}")
+            return
+        # Um CSV só com o cabeçalho pode não gerar bloco algum
+        previsoes = pd.concat(blocos, ignore_index=True) if blocos else pd.DataFrame()
+        if previsoes.empty:
+            st.info("O CSV enviado não tem linhas.")
+        else:
+            st.dataframe(previsoes.head(100), use_container_width=True)
+            st.download_button(
+                "Baixar previsões", previsoes.to_csv(sep=';', index=False).encode('latin1', errors='replace'),
+                file_name='previsoes_enem.csv', mime='text/csv'
+            )
+
+bloco_piramide(ano, sexo, escola, estado, municipio)
+bloco_resumo(ano, sexo, escola, estado, municipio)
+bloco_violino(ano, sexo, escola, estado, municipio)
+bloco_percentil(ano, sexo, escola, estado, municipio)
+bloco_comparacao(ano, sexo, estado, municipio)
+bloco_regioes(ano, estado)
+bloco_predicao(ano, sexo, escola, estado, municipio)
+
+# Painel de desempenho da execução
+etapas = finalizar_coleta(
+    ano=ano, sexo=sexo, escola=escola, estado=estado, municipio=municipio,
+    total_ms=round((time.perf_counter() - inicio_execucao) * 1000, 3)
 )
-st.plotly_chart(fig_violino, use_container_width=True)
\ No newline at end of file
+registrar_partida(primeira_execucao_ms=round((time.perf_counter() - inicio_importacoes) * 1000, 3))
+with st.sidebar.expander("Desempenho"):
+    st.checkbox("Mostrar painel de desempenho", key='depuracao')
+    st.checkbox("Medir memória alocada (tracemalloc, afeta todas as sessões)", key='depuracao_memoria')
+    if depuracao and etapas:
+        tabela = pd.DataFrame(etapas)
+        tabela['etapa'] = ['· ' * nivel + etapa for nivel, etapa in zip(tabela.pop('nivel'), tabela['etapa'])]
+        st.caption(f"Execução: {(time.perf_counter() - inicio_execucao) * 1000:.0f} ms")
+        st.caption(
+            f"Partida do processo: importações {PARTIDA['importacoes_ms']:.0f} ms, "
+            f"primeira execução {PARTIDA['primeira_execucao_ms']:.0f} ms"
+        )
+        st.dataframe(tabela.set_index('etapa'), use_container_width=True)
+        st.caption("Cache de tarefas do painel")
+        st.json(CACHE_TAREFAS.estatisticas())
+        st.caption("Cache de comparações")
+        st.json(CACHE_COMPARACOES.estatisticas())
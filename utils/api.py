@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from streamlit import logger
+
+from utils.comparacao import comparacao_escolas
+from utils.processamento import (
+    ANO_PADRAO, MEDIDAS, NIVEIS_REGIAO, UFS, CacheLRU, calcular_resumo_graficos, carregar_opcoes_regiao,
+    carregar_regioes, consultar_percentil, edicoes_disponiveis, versao_edicao
+)
+
+# API HTTP/JSON local com os mesmos números do painel, sem o servidor do Streamlit:
+#   python -m utils.api [--host 127.0.0.1] [--porta 8502]
+# Rotas GET com os filtros da barra lateral como parâmetros (ano, sexo, escola, estado, municipio):
+#   /edicoes  /opcoes  /resumo  /piramide  /escolas  /dependencias  /disciplinas
+#   /percentil (medida, nota)  /regioes (nivel)  /comparacao  /estatisticas
+# As respostas ficam num cache de Futures chaveado por (rota, versão dos dados, parâmetros): pedidos
+# iguais simultâneos esperam o mesmo cálculo, e os seguintes recebem o JSON pronto. O ETag deriva da
+# mesma chave, então If-None-Match responde 304 sem calcular enquanto os dados não mudarem
+HOST_PADRAO = '127.0.0.1'
+PORTA_PADRAO = 8502
+# Tempo máximo de espera por um pedido numa conexão mantida aberta (segundos)
+ESPERA_CONEXAO = 30
+TAMANHO_MAXIMO_CABECALHO = 16384
+
+EXECUTOR_API = ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 4), thread_name_prefix='api')
+CACHE_RESPOSTAS = CacheLRU(capacidade=512, validade=3600)
+
+FILTROS = {
+    'sexo': ['Todos', 'Masculino', 'Feminino'],
+    'escola': ['Todos', 'Pública', 'Privada'],
+    'estado': ['Todos'] + UFS
+}
+
+# Erro de uma rota com o status HTTP da resposta
+class ErroRequisicao(Exception):
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+
+# DataFrame como lista de objetos JSON (NaN vira null)
+def registros(df):
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+# Valor escalar para JSON (NaN vira null)
+def numero(valor):
+    valor = float(valor)
+    return None if math.isnan(valor) else valor
+
+def parametro(parametros, nome, padrao=None, opcoes=None):
+    valor = parametros.get(nome, [padrao])[-1]
+    if valor is None:
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, f"Parâmetro obrigatório: {nome}")
+    if opcoes is not None and valor not in opcoes:
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, f"{nome} deve ser um de: {', '.join(map(str, opcoes))}")
+    return valor
+
+def parametro_numerico(parametros, nome, tipo, padrao=None):
+    valor = parametro(parametros, nome, padrao)
+    try:
+        return tipo(valor)
+    except ValueError:
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, f"{nome} inválido: {valor}") from None
+
+def ler_ano(parametros):
+    ano = parametro_numerico(parametros, 'ano', int, ANO_PADRAO)
+    if ano not in edicoes_disponiveis():
+        raise ErroRequisicao(HTTPStatus.NOT_FOUND, f"Edição {ano} do ENEM não encontrada")
+    return ano
+
+# Filtros da barra lateral: (ano, sexo, escola, estado, municipio)
+def ler_recorte(parametros):
+    return (
+        ler_ano(parametros),
+        *(parametro(parametros, nome, 'Todos', opcoes) for nome, opcoes in FILTROS.items()),
+        parametro(parametros, 'municipio', 'Todos')
+    )
+
+# Rotas. Cada uma valida os parâmetros e devolve (versão dos dados, argumentos, função de cálculo).
+# A rota é barata (lê só o manifesto) e decide o ETag; o cálculo só roda se a resposta não estiver em cache
+def rota_edicoes(parametros):
+    edicoes = edicoes_disponiveis()
+    return tuple(edicoes), (), lambda: {'edicoes': edicoes}
+
+def rota_opcoes(parametros):
+    ano = ler_ano(parametros)
+
+    def calcular(ano):
+        ufs, municipios_por_uf = carregar_opcoes_regiao(ano)
+        return {'ano': ano, 'estados': ufs, 'municipios': municipios_por_uf}
+    return versao_edicao(ano), (ano,), calcular
+
+def rota_resumo(parte=None):
+    def rota(parametros):
+        recorte = ler_recorte(parametros)
+
+        def calcular(ano, sexo, escola, estado, municipio):
+            dados = calcular_resumo_graficos(ano, sexo, escola, estado, municipio)
+            partes = {nome: registros(dados[nome]) for nome in ('piramide', 'escola', 'dependencia', 'disciplinas')}
+            return partes if parte is None else {parte: partes[parte]}
+        return versao_edicao(recorte[0], estado=recorte[3]), recorte, calcular
+    return rota
+
+def rota_percentil(parametros):
+    recorte = ler_recorte(parametros)
+    medida = parametro(parametros, 'medida', 'MEDIA_NOTAS', MEDIDAS)
+    nota = parametro_numerico(parametros, 'nota', float)
+    if not (math.isfinite(nota) and 0 <= nota <= 1000):
+        raise ErroRequisicao(HTTPStatus.BAD_REQUEST, f"nota deve estar entre 0 e 1000: {nota:g}")
+
+    def calcular(ano, sexo, escola, estado, municipio, medida, nota):
+        consulta = consultar_percentil(ano, medida, nota, sexo, escola, estado, municipio)
+        return {
+            'medida': medida, 'nota': nota, 'quantidade': consulta['quantidade'],
+            'percentil': numero(consulta['percentil']),
+            'quantis': {f'{quantil:g}': numero(valor) for quantil, valor in consulta['quantis'].items()}
+        }
+    return versao_edicao(recorte[0], estado=recorte[3]), (*recorte, medida, nota), calcular
+
+def rota_regioes(parametros):
+    ano = ler_ano(parametros)
+    nivel = parametro(parametros, 'nivel', 'uf', list(NIVEIS_REGIAO))
+    return versao_edicao(ano), (ano, nivel), lambda ano, nivel: registros(carregar_regioes(ano, nivel))
+
+def rota_comparacao(parametros):
+    ano, sexo, _, estado, municipio = ler_recorte(parametros)
+
+    def calcular(ano, sexo, estado, municipio):
+        return registros(comparacao_escolas(ano, sexo, estado, municipio))
+    return versao_edicao(ano, estado=estado), (ano, sexo, estado, municipio), calcular
+
+ROTAS = {
+    '/edicoes': rota_edicoes,
+    '/opcoes': rota_opcoes,
+    '/resumo': rota_resumo(),
+    '/piramide': rota_resumo('piramide'),
+    '/escolas': rota_resumo('escola'),
+    '/dependencias': rota_resumo('dependencia'),
+    '/disciplinas': rota_resumo('disciplinas'),
+    '/percentil': rota_percentil,
+    '/regioes': rota_regioes,
+    '/comparacao': rota_comparacao
+}
+
+# ETag de uma resposta: muda com a versão dos dados (da edição, ou da UF filtrada)
+def etag(chave):
+    return '"' + hashlib.sha1(repr(chave).encode()).hexdigest()[:24] + '"'
+
+# Corpo JSON de uma rota, calculado uma única vez por chave. Um cálculo que falhou é descartado do
+# cache para que o próximo pedido tente de novo
+async def responder(chave, calcular, argumentos):
+    laco = asyncio.get_running_loop()
+    futuro = CACHE_RESPOSTAS.obter(
+        chave,
+        lambda: asyncio.ensure_future(laco.run_in_executor(
+            EXECUTOR_API, lambda: json.dumps(calcular(*argumentos), ensure_ascii=False).encode()
+        ))
+    )
+    try:
+        return await asyncio.shield(futuro)
+    except Exception:
+        CACHE_RESPOSTAS.descartar(chave)
+        raise
+
+# Status, cabeçalhos extras e corpo da resposta a um GET
+async def atender(alvo, cabecalhos):
+    endereco = urlsplit(alvo)
+    parametros = parse_qs(endereco.query)
+    if endereco.path == '/estatisticas':
+        return HTTPStatus.OK, {'Cache-Control': 'no-store'}, json.dumps(CACHE_RESPOSTAS.estatisticas()).encode()
+    if endereco.path not in ROTAS:
+        raise ErroRequisicao(HTTPStatus.NOT_FOUND, f"Rota desconhecida: {endereco.path}")
+    try:
+        # Em thread: a versão pode exigir particionar a edição, se o CSV mudou
+        versao, argumentos, calcular = await asyncio.get_running_loop().run_in_executor(
+            EXECUTOR_API, ROTAS[endereco.path], parametros
+        )
+    except FileNotFoundError as erro:
+        raise ErroRequisicao(HTTPStatus.NOT_FOUND, str(erro)) from None
+    chave = (endereco.path, versao, argumentos)
+    extras = {'ETag': etag(chave), 'Cache-Control': 'no-cache'}
+    if extras['ETag'] in [valor.strip() for valor in cabecalhos.get('if-none-match', '').split(',')]:
+        return HTTPStatus.NOT_MODIFIED, extras, b''
+    return HTTPStatus.OK, extras, await responder(chave, calcular, argumentos)
+
+def montar_resposta(status, extras, corpo, manter):
+    linhas = [f'HTTP/1.1 {status.value} {status.phrase}']
+    cabecalhos = {
+        'Content-Type': 'application/json; charset=utf-8', 'Content-Length': str(len(corpo)),
+        'Connection': 'keep-alive' if manter else 'close', **extras
+    }
+    linhas += [f'{nome}: {valor}' for nome, valor in cabecalhos.items()]
+    return ('\r\n'.join(linhas) + '\r\n\r\n').encode('latin1') + corpo
+
+# Uma conexão HTTP/1.1: atende pedidos em sequência enquanto o cliente a mantiver aberta
+async def tratar_conexao(leitor, escritor):
+    try:
+        while True:
+            try:
+                cabecalho = await asyncio.wait_for(leitor.readuntil(b'\r\n\r\n'), ESPERA_CONEXAO)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError):
+                break
+            linha, *campos = cabecalho.decode('latin1').split('\r\n')
+            cabecalhos = {
+                nome.strip().lower(): valor.strip()
+                for nome, _, valor in (campo.partition(':') for campo in campos if campo)
+            }
+            try:
+                metodo, alvo, protocolo = linha.split(' ')
+            except ValueError:
+                break
+            # Só GET mantém a conexão: o corpo de outros métodos não é lido
+            manter = metodo == 'GET' and protocolo == 'HTTP/1.1' and cabecalhos.get('connection', '').lower() != 'close'
+            try:
+                if metodo != 'GET':
+                    raise ErroRequisicao(HTTPStatus.METHOD_NOT_ALLOWED, f"Método não suportado: {metodo}")
+                status, extras, corpo = await atender(alvo, cabecalhos)
+            except ErroRequisicao as erro:
+                status, extras, corpo = erro.status, {}, json.dumps({'erro': str(erro)}, ensure_ascii=False).encode()
+            except Exception as erro:
+                logger.get_logger(__name__).exception("Erro ao atender %s", alvo)
+                status, extras = HTTPStatus.INTERNAL_SERVER_ERROR, {}
+                corpo = json.dumps({'erro': repr(erro)}, ensure_ascii=False).encode()
+            escritor.write(montar_resposta(status, extras, corpo, manter))
+            await escritor.drain()
+            if not manter:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        escritor.close()
+
+async def servir(host=HOST_PADRAO, porta=PORTA_PADRAO):
+    servidor = await asyncio.start_server(tratar_conexao, host, porta, limit=TAMANHO_MAXIMO_CABECALHO)
+    print(f"API do painel em http://{host}:{porta}")
+    async with servidor:
+        await servidor.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='API HTTP/JSON com os agregados do painel')
+    parser.add_argument('--host', default=HOST_PADRAO)
+    parser.add_argument('--porta', type=int, default=PORTA_PADRAO)
+    argumentos = parser.parse_args()
+    logger.set_log_level('error')
+    try:
+        asyncio.run(servir(argumentos.host, argumentos.porta))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,103 @@
+import functools
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import Future
+
+from streamlit import logger
+
+from utils.painel import (
+    CACHE_TAREFAS, chave_comparacao, chave_regioes, chave_resumo, chave_violino, montar_comparacao,
+    montar_regioes, montar_resumo, montar_violino
+)
+from utils.processamento import (
+    carregar_opcoes_regiao, diretorio_edicao, edicoes_disponiveis, garantir_edicao, versao_edicao
+)
+
+# Aquecimento para a partida rápida do app. No deploy, `python -m utils.aquecimento [ano ...]` particiona
+# cada edição (dados tratados e clusters), calcula as opções da barra lateral e as tarefas da visão
+# padrão do painel (todos os filtros em 'Todos') e grava tudo em aquecimento.pkl, no diretório da
+# edição. Refazer a edição ou anexar linhas substitui o diretório, então o artefato nunca sobrevive
+# aos dados de que saiu; ainda assim, ele só é usado se a versão gravada for a atual
+RECORTE_PADRAO = ('Todos', 'Todos', 'Todos', 'Todos')
+MEDIDA_REGIAO_PADRAO = 'MEDIA_NOTAS'
+
+def caminho_aquecimento(ano):
+    return os.path.join(diretorio_edicao(ano), 'aquecimento.pkl')
+
+# Tarefas da visão padrão: (chave, função, argumentos), como o painel as agenda
+def tarefas_padrao(ano):
+    sexo, escola, estado, municipio = RECORTE_PADRAO
+    return [
+        (chave_resumo(ano, *RECORTE_PADRAO), montar_resumo, (ano, *RECORTE_PADRAO)),
+        (chave_violino(ano, *RECORTE_PADRAO), montar_violino, (ano, *RECORTE_PADRAO)),
+        (chave_comparacao(ano, sexo, estado, municipio), montar_comparacao, (ano, sexo, estado, municipio)),
+        (chave_regioes(ano, estado, MEDIDA_REGIAO_PADRAO), montar_regioes, (ano, estado, MEDIDA_REGIAO_PADRAO))
+    ]
+
+# Gera e grava o artefato de uma edição; devolve o tempo de cada etapa
+def gerar_aquecimento(ano):
+    tempos = {}
+    inicio = time.perf_counter()
+    garantir_edicao(ano)
+    tempos['edicao'] = time.perf_counter() - inicio
+    artefato = {'versao': versao_edicao(ano), 'opcoes': carregar_opcoes_regiao(ano), 'tarefas': {}}
+    for chave, montar, argumentos in tarefas_padrao(ano):
+        inicio = time.perf_counter()
+        artefato['tarefas'][chave] = montar(*argumentos)
+        tempos[chave[0]] = time.perf_counter() - inicio
+
+    temporario = f'{caminho_aquecimento(ano)}.tmp{os.getpid()}'
+    with open(temporario, 'wb') as arquivo:
+        pickle.dump(artefato, arquivo, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporario, caminho_aquecimento(ano))
+    return tempos
+
+# Artefato de uma edição (None se não existe ou é de outra versão). O cache é chaveado pelo inode e
+# pela data de modificação do arquivo, como em ler_manifesto: um artefato gerado com o app no ar (por
+# exemplo depois de anexar linhas, que apaga o anterior) é lido na execução seguinte
+def ler_aquecimento(ano, versao):
+    try:
+        info = os.stat(caminho_aquecimento(ano))
+    except FileNotFoundError:
+        return None
+    artefato = ler_artefato(caminho_aquecimento(ano), info.st_ino, info.st_mtime_ns)
+    return artefato if artefato is not None and artefato['versao'] == versao else None
+
+@functools.lru_cache(maxsize=8)
+def ler_artefato(caminho, inode, modificacao):
+    try:
+        with open(caminho, 'rb') as arquivo:
+            return pickle.load(arquivo)
+    except FileNotFoundError:
+        return None
+
+# Entrega as tarefas prontas do artefato ao cache do painel, para que a visão padrão seja exibida sem
+# calcular nada. Roda a cada chamada: se a validade ou o LRU do cache descartou uma tarefa, ela volta
+# do artefato (já em memória) em vez de ser recalculada; as que ainda estão no cache ficam como estão.
+# Devolve o artefato, ou None
+def semear_tarefas(ano, versao):
+    artefato = ler_aquecimento(ano, versao)
+    if artefato is None:
+        return None
+    for chave, valor in artefato['tarefas'].items():
+        futuro = Future()
+        futuro.set_result(valor)
+        CACHE_TAREFAS.semear(chave, futuro)
+    return artefato
+
+def aquecer(ano):
+    return semear_tarefas(ano, versao_edicao(ano))
+
+# Opções da barra lateral, do artefato quando ele existe (sem ler o cubo)
+def opcoes_regiao(ano):
+    artefato = ler_aquecimento(ano, versao_edicao(ano))
+    return carregar_opcoes_regiao(ano) if artefato is None else artefato['opcoes']
+
+# Gera os artefatos das edições informadas (ou de todas): python -m utils.aquecimento [ano ...]
+if __name__ == '__main__':
+    logger.set_log_level('error')
+    for ano in [int(argumento) for argumento in sys.argv[1:]] or edicoes_disponiveis():
+        tempos = gerar_aquecimento(ano)
+        print(f"{ano}: " + ', '.join(f'{etapa} {segundos:.2f} s' for etapa, segundos in tempos.items()))
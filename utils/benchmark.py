@@ -0,0 +1,256 @@
+import argparse
+import csv
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from streamlit import logger
+
+from utils import processamento
+from utils.graficos import gerar_figuras_painel
+from utils.processamento import (
+    ANO_PADRAO, NOTAS, UFS, calcular_dados_graficos, construir_indice,
+    linhas_selecionadas, mapear_edicao, particionar_edicao, selecionar_linhas, versao_edicao
+)
+
+# Benchmark do pipeline carregar -> filtrar -> agregar -> gráficos sobre dados sintéticos no formato
+# do ENEM, sem microdados reais:
+#   python -m utils.benchmark [--linhas 100000 1000000 5000000] [--saida arquivo.json] [--comparar anterior.json]
+# Cada etapa registra o tempo de parede e o pico de memória residente acima do início da etapa
+TAMANHOS_PADRAO = [100_000, 1_000_000, 5_000_000]
+BLOCO_GERACAO = 500_000
+
+# População aproximada (milhões) e número de municípios de cada UF: pesos da geração sintética
+POPULACAO_UF = {
+    'AC': 0.83, 'AL': 3.1, 'AM': 3.9, 'AP': 0.73, 'BA': 14.1, 'CE': 8.8, 'DF': 2.8, 'ES': 3.8,
+    'GO': 7.0, 'MA': 6.8, 'MG': 20.5, 'MS': 2.8, 'MT': 3.7, 'PA': 8.1, 'PB': 4.0, 'PE': 9.1,
+    'PI': 3.3, 'PR': 11.4, 'RJ': 16.1, 'RN': 3.3, 'RO': 1.6, 'RR': 0.64, 'RS': 10.9, 'SC': 7.6,
+    'SE': 2.2, 'SP': 44.4, 'TO': 1.5
+}
+MUNICIPIOS_UF = {
+    'AC': 22, 'AL': 102, 'AM': 62, 'AP': 16, 'BA': 417, 'CE': 184, 'DF': 1, 'ES': 78,
+    'GO': 246, 'MA': 217, 'MG': 853, 'MS': 79, 'MT': 141, 'PA': 144, 'PB': 223, 'PE': 185,
+    'PI': 224, 'PR': 399, 'RJ': 92, 'RN': 167, 'RO': 52, 'RR': 15, 'RS': 497, 'SC': 295,
+    'SE': 75, 'SP': 645, 'TO': 139
+}
+# Média e desvio de cada prova (escola pública) e acréscimo médio da escola privada
+DISTRIBUICAO_NOTAS = {
+    'NU_NOTA_CN': (490, 75), 'NU_NOTA_CH': (515, 80), 'NU_NOTA_LC': (515, 70),
+    'NU_NOTA_MT': (525, 105), 'NU_NOTA_REDACAO': (620, 180)
+}
+BONUS_PRIVADA = 80
+
+# Recortes medidos nas etapas de filtro, agregação e gráficos
+def recortes_benchmark():
+    return [
+        ('Todos', 'Todos', 'Todos', 'Todos'),
+        ('Feminino', 'Todos', 'Todos', 'Todos'),
+        ('Todos', 'Privada', 'SP', 'Todos'),
+        ('Masculino', 'Pública', 'MG', 'Município MG 0000'),
+        ('Todos', 'Todos', 'RJ', 'Município RJ 0001')
+    ]
+
+# Gera um CSV determinístico no formato de dados/enem_tratado.csv (latin1, ';', códigos do INEP),
+# em blocos para não materializar todas as linhas de uma vez. Municípios seguem uma lei de Zipf
+# dentro de cada UF
+def gerar_csv_sintetico(caminho, linhas, semente=42):
+    gerador = np.random.default_rng(semente)
+    pesos_uf = np.array([POPULACAO_UF[uf] for uf in UFS])
+    pesos_uf /= pesos_uf.sum()
+    municipios = {
+        uf: np.array([f'Município {uf} {i:04d}' for i in range(MUNICIPIOS_UF[uf])], dtype=object)
+        for uf in UFS
+    }
+    pesos_municipio = {}
+    for uf in UFS:
+        pesos = 1 / np.arange(1, MUNICIPIOS_UF[uf] + 1)
+        pesos_municipio[uf] = pesos / pesos.sum()
+
+    os.makedirs(os.path.dirname(caminho) or '.', exist_ok=True)
+    for inicio in range(0, linhas, BLOCO_GERACAO):
+        n = min(BLOCO_GERACAO, linhas - inicio)
+        uf = gerador.choice(len(UFS), n, p=pesos_uf)
+        municipio = np.empty(n, dtype=object)
+        for codigo, sigla in enumerate(UFS):
+            linhas_uf = np.flatnonzero(uf == codigo)
+            municipio[linhas_uf] = municipios[sigla][
+                gerador.choice(MUNICIPIOS_UF[sigla], len(linhas_uf), p=pesos_municipio[sigla])
+            ]
+        escola = gerador.choice([1, 2, 3], n, p=[0.6, 0.33, 0.07])
+        dependencia = np.where(escola == 3, 4.0, gerador.choice([1.0, 2.0, 3.0], n, p=[0.03, 0.88, 0.09]))
+        dependencia[(escola == 1) & (gerador.random(n) < 0.8)] = np.nan
+        bloco = pd.DataFrame({
+            'NU_INSCRICAO': np.arange(inicio, inicio + n) + 210000000000,
+            'NU_ANO': ANO_PADRAO,
+            'TP_FAIXA_ETARIA': np.minimum(gerador.geometric(0.35, n), 20),
+            'TP_SEXO': np.where(gerador.random(n) < 0.6, 'F', 'M'),
+            'TP_ESCOLA': escola,
+            'NO_MUNICIPIO_ESC': municipio,
+            'SG_UF_ESC': np.array(UFS, dtype=object)[uf],
+            'TP_DEPENDENCIA_ADM_ESC': dependencia
+        })
+        for nota, (media, desvio) in DISTRIBUICAO_NOTAS.items():
+            valores = gerador.normal(media + BONUS_PRIVADA * (escola == 3), desvio)
+            if nota == 'NU_NOTA_REDACAO':
+                valores = np.clip(np.round(valores / 20) * 20, 0, 1000)
+            else:
+                valores = np.clip(np.round(valores, 1), 0, 1000)
+            valores[gerador.random(n) < 0.03] = np.nan
+            bloco[nota] = valores
+        bloco.to_csv(
+            caminho, sep=';', encoding='latin1', index=False, mode='w' if inicio == 0 else 'a',
+            header=inicio == 0, quoting=csv.QUOTE_MINIMAL
+        )
+
+# Caches do processo (Streamlit e mapeamentos): cada tamanho roda num diretório próprio
+def limpar_caches():
+    for funcao in (processamento.dados_versao, processamento.cubo_versao, processamento.indice_versao,
+                   processamento.regioes_versao, processamento.opcoes_regiao_versao,
+                   processamento.histogramas_versao):
+        funcao.clear()
+    mapear_edicao.cache_clear()
+    processamento.ler_json.cache_clear()
+
+# Memória residente do processo (bytes), lida de /proc no Linux
+def memoria_residente():
+    with open('/proc/self/statm') as arquivo:
+        return int(arquivo.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+# Executa uma etapa medindo o tempo de parede e o pico de memória residente acima do início da etapa,
+# amostrado por uma thread a cada INTERVALO_AMOSTRAGEM segundos (tracemalloc distorceria os tempos)
+INTERVALO_AMOSTRAGEM = 0.005
+
+def medir(resultados, etapa, funcao):
+    inicial = memoria_residente()
+    pico = [inicial]
+    parar = threading.Event()
+
+    def amostrar():
+        while not parar.wait(INTERVALO_AMOSTRAGEM):
+            pico[0] = max(pico[0], memoria_residente())
+
+    amostrador = threading.Thread(target=amostrar, daemon=True)
+    amostrador.start()
+    inicio = time.perf_counter()
+    try:
+        valor = funcao()
+    finally:
+        segundos = time.perf_counter() - inicio
+        parar.set()
+        amostrador.join()
+    pico_mb = (max(pico[0], memoria_residente()) - inicial) / 2 ** 20
+    resultados[etapa] = {'segundos': round(segundos, 4), 'pico_memoria_mb': round(pico_mb, 2)}
+    return valor
+
+# Todas as etapas para um tamanho de dados, num diretório temporário
+def medir_tamanho(linhas, semente=42):
+    etapas = {}
+    diretorio_original = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='benchmark_enem_') as diretorio:
+        os.chdir(diretorio)
+        try:
+            limpar_caches()
+            medir(etapas, 'gerar_csv', lambda: gerar_csv_sintetico(processamento.CAMINHO_CSV, linhas, semente))
+            medir(etapas, 'etl', lambda: particionar_edicao(ANO_PADRAO))
+            df = medir(etapas, 'carregar', lambda: mapear_edicao(ANO_PADRAO, versao_edicao(ANO_PADRAO)))
+            indice = medir(etapas, 'indice', lambda: construir_indice(df))
+
+            recortes = recortes_benchmark()
+            medir(etapas, 'filtrar', lambda: [
+                linhas_selecionadas(df, selecionar_linhas(indice, *recorte), NOTAS) for recorte in recortes
+            ])
+            # Primeira passada aquece os caches de cubo, dados e índice por UF; a medida é da segunda
+            for recorte in recortes:
+                calcular_dados_graficos(ANO_PADRAO, *recorte)
+            graficos = medir(etapas, 'agregar', lambda: [
+                calcular_dados_graficos(ANO_PADRAO, *recorte) for recorte in recortes
+            ])
+            medir(etapas, 'figuras', lambda: [gerar_figuras_painel(dados) for dados in graficos])
+            linhas_tratadas = len(df)
+        finally:
+            os.chdir(diretorio_original)
+            limpar_caches()
+    return {'linhas': linhas, 'linhas_tratadas': linhas_tratadas, 'recortes': len(recortes), 'etapas': etapas}
+
+# Tempo de importação dos módulos do app num interpretador novo, acumulado módulo a módulo na ordem
+# em que o app os importa (é o custo de partida de cada processo do servidor)
+MODULOS_APP = ['streamlit', 'pandas', 'utils.aquecimento', 'utils.predicao']
+
+def medir_importacao(modulos=MODULOS_APP):
+    codigo = (
+        "import importlib, json, sys, time\n"
+        "tempos = {}\n"
+        "for modulo in sys.argv[1:]:\n"
+        "    inicio = time.perf_counter()\n"
+        "    importlib.import_module(modulo)\n"
+        "    tempos[modulo] = round(time.perf_counter() - inicio, 4)\n"
+        "print(json.dumps(tempos))"
+    )
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    saida = subprocess.run(
+        [sys.executable, '-c', codigo, *modulos], cwd=raiz, capture_output=True, text=True, check=True
+    )
+    return json.loads(saida.stdout.splitlines()[-1])
+
+# Razão entre os tempos desta execução e os de uma anterior, por tamanho e etapa
+def comparar_resultados(atual, anterior):
+    anteriores = {medida['linhas']: medida['etapas'] for medida in anterior['medidas']}
+    for medida in atual['medidas']:
+        base = anteriores.get(medida['linhas'])
+        if base is None:
+            continue
+        for etapa, valores in medida['etapas'].items():
+            if etapa in base and base[etapa]['segundos'] > 0:
+                razao = valores['segundos'] / base[etapa]['segundos']
+                print(f"{medida['linhas']:>10} {etapa:<10} {base[etapa]['segundos']:>9.3f} s -> "
+                      f"{valores['segundos']:>9.3f} s ({razao:.2f}x)")
+
+def executar_benchmark(tamanhos=TAMANHOS_PADRAO, semente=42):
+    logger.set_log_level('error')
+    importacao = medir_importacao()
+    print(f"importação dos módulos do app: {sum(importacao.values()):.3f} s "
+          + ' '.join(f'({modulo} {segundos:.3f} s)' for modulo, segundos in importacao.items()))
+    medidas = []
+    for linhas in tamanhos:
+        medida = medir_tamanho(linhas, semente)
+        medidas.append(medida)
+        for etapa, valores in medida['etapas'].items():
+            print(f"{linhas:>10} {etapa:<10} {valores['segundos']:>9.3f} s {valores['pico_memoria_mb']:>9.1f} MB")
+    return {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'semente': semente,
+        'ambiente': {
+            'python': platform.python_version(), 'plataforma': platform.platform(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'processadores': os.cpu_count()
+        },
+        # ru_maxrss é em KiB no Linux
+        'pico_rss_processo_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'importacao_app_s': importacao,
+        'medidas': medidas
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark do pipeline com dados sintéticos do ENEM')
+    parser.add_argument('--linhas', type=int, nargs='+', default=TAMANHOS_PADRAO)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--saida', default=None, help='arquivo JSON (padrão: benchmark_<data>.json)')
+    parser.add_argument('--comparar', default=None, help='JSON de uma execução anterior')
+    argumentos = parser.parse_args()
+
+    resultado = executar_benchmark(argumentos.linhas, argumentos.semente)
+    saida = argumentos.saida or f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+    print(f'Resultados gravados em {saida}')
+    if argumentos.comparar:
+        with open(argumentos.comparar, encoding='utf-8') as arquivo:
+            comparar_resultados(resultado, json.load(arquivo))
@@ -0,0 +1,134 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.instrumentacao import cronometrado, medir
+from utils.processamento import (
+    LEGENDA_MEDIDAS, MEDIDAS, CacheLRU, carregar_dados, carregar_indice,
+    linhas_selecionadas, selecionar_linhas, versao_edicao
+)
+
+# Comparação Pública x Privada: diferença das médias (Privada - Pública) de cada nota, com intervalo
+# de confiança por bootstrap percentil e tamanho de efeito (d de Cohen)
+N_REAMOSTRAS = 1000
+NIVEL_CONFIANCA = 0.95
+# Sorteios por lote (linhas x reamostras): limita a memória de cada lote
+LIMITE_ELEMENTOS_LOTE = 4_000_000
+# Abaixo deste volume (linhas x reamostras) o bootstrap roda no próprio processo
+LIMITE_PARALELO = 50_000_000
+# Reamostras por bloco. Cada bloco tem a sua semente (filha da semente do grupo), então o resultado
+# não depende de quantos processos há nem de o bootstrap rodar em série ou no pool
+REAMOSTRAS_POR_BLOCO = 50
+
+_executor = None
+_trava_executor = threading.Lock()
+
+# Pool de processos compartilhado, criado na primeira comparação grande. Usa 'spawn' porque o
+# servidor do Streamlit tem várias threads e um fork poderia herdar travas ocupadas
+def executor():
+    global _executor
+    with _trava_executor:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+# Médias de todas as notas (colunas de valores) em n_reamostras reamostras com reposição dos
+# participantes. Cada lote conta quantas vezes cada linha foi sorteada (um bincount) e obtém as
+# médias por produto de matrizes
+def medias_bootstrap(valores, n_reamostras, semente):
+    gerador = np.random.default_rng(semente)
+    n = len(valores)
+    por_lote = max(1, LIMITE_ELEMENTOS_LOTE // n)
+    medias = np.empty((n_reamostras, valores.shape[1]))
+    for inicio in range(0, n_reamostras, por_lote):
+        lote = min(por_lote, n_reamostras - inicio)
+        sorteios = gerador.integers(0, n, size=(lote, n)) + (np.arange(lote) * n)[:, None]
+        repeticoes = np.bincount(sorteios.ravel(), minlength=lote * n).reshape(lote, n)
+        medias[inicio:inicio + lote] = repeticoes @ valores / n
+    return medias
+
+# Médias de uma sequência de blocos de reamostras, um gerador por bloco
+def medias_blocos(valores, tamanhos, sementes):
+    return np.vstack([medias_bootstrap(valores, tamanho, semente) for tamanho, semente in zip(tamanhos, sementes)])
+
+# Reamostras em blocos de tamanho fixo; os blocos são divididos entre os processos do pool quando
+# o volume compensa (os valores são enviados uma vez por processo)
+def bootstrap_grupo(valores, n_reamostras, semente):
+    tamanhos = [
+        min(REAMOSTRAS_POR_BLOCO, n_reamostras - inicio) for inicio in range(0, n_reamostras, REAMOSTRAS_POR_BLOCO)
+    ]
+    sementes = semente.spawn(len(tamanhos))
+    partes = min(os.cpu_count() or 1, len(tamanhos))
+    if len(valores) * n_reamostras < LIMITE_PARALELO or partes == 1:
+        return medias_blocos(valores, tamanhos, sementes)
+    divisoes = np.array_split(np.arange(len(tamanhos)), partes)
+    return np.vstack(list(executor().map(
+        medias_blocos, [valores] * partes,
+        [[tamanhos[i] for i in divisao] for divisao in divisoes],
+        [[sementes[i] for i in divisao] for divisao in divisoes]
+    )))
+
+# Diferença, intervalo de confiança e d de Cohen de cada nota entre os dois tipos de escola
+def comparar_grupos(publica, privada, n_reamostras=N_REAMOSTRAS, semente=42):
+    comparacao = pd.DataFrame({
+        'Medida': MEDIDAS, 'Disciplina': [LEGENDA_MEDIDAS[medida] for medida in MEDIDAS],
+        'Quantidade Pública': len(publica), 'Quantidade Privada': len(privada)
+    })
+    if min(len(publica), len(privada)) < 2:
+        for coluna in ['Média Pública', 'Média Privada', 'Diferença', 'IC Inferior', 'IC Superior', 'd de Cohen']:
+            comparacao[coluna] = np.nan
+        return comparacao
+
+    media_publica = publica.mean(axis=0)
+    media_privada = privada.mean(axis=0)
+    semente_publica, semente_privada = np.random.SeedSequence(semente).spawn(2)
+    diferencas = (bootstrap_grupo(privada, n_reamostras, semente_privada)
+                  - bootstrap_grupo(publica, n_reamostras, semente_publica))
+    alfa = (1 - NIVEL_CONFIANCA) / 2
+    inferior, superior = np.quantile(diferencas, [alfa, 1 - alfa], axis=0)
+
+    desvio = np.sqrt(
+        ((len(publica) - 1) * publica.var(axis=0, ddof=1) + (len(privada) - 1) * privada.var(axis=0, ddof=1))
+        / (len(publica) + len(privada) - 2)
+    )
+    comparacao['Média Pública'] = media_publica
+    comparacao['Média Privada'] = media_privada
+    comparacao['Diferença'] = media_privada - media_publica
+    comparacao['IC Inferior'] = inferior
+    comparacao['IC Superior'] = superior
+    comparacao['d de Cohen'] = np.divide(
+        media_privada - media_publica, desvio, out=np.full(len(MEDIDAS), np.nan), where=desvio > 0
+    )
+    return comparacao
+
+# Comparação para um recorte da barra lateral (o filtro de tipo de escola não se aplica: são os
+# dois grupos comparados)
+@cronometrado('calcular_comparacao')
+def calcular_comparacao(ano, sexo='Todos', estado='Todos', municipio='Todos', limite_linhas=None,
+                        n_reamostras=N_REAMOSTRAS, semente=42):
+    ufs = None if estado == 'Todos' else [estado]
+    df = carregar_dados(ano, ufs, limite_linhas)
+    posicoes = selecionar_linhas(carregar_indice(ano, ufs, limite_linhas), sexo, 'Todos', estado, municipio)
+    linhas = linhas_selecionadas(df, posicoes, ['TP_ESCOLA'] + MEDIDAS)
+    valores = linhas[MEDIDAS].to_numpy(dtype='float64')
+    escola = linhas['TP_ESCOLA']
+    return comparar_grupos(
+        valores[(escola == 'Pública').to_numpy()], valores[(escola == 'Privada').to_numpy()],
+        n_reamostras, semente
+    )
+
+CACHE_COMPARACOES = CacheLRU(capacidade=64, validade=3600)
+
+# Mesma comparação, memoizada por (versão dos dados do recorte, sexo, estado, município)
+def comparacao_escolas(ano, sexo='Todos', estado='Todos', municipio='Todos', limite_linhas=None):
+    chave = (versao_edicao(ano, limite_linhas, estado), sexo, estado, municipio)
+    with medir('comparacao_escolas'):
+        return CACHE_COMPARACOES.obter(
+            chave, lambda: calcular_comparacao(ano, sexo, estado, municipio, limite_linhas)
+        )
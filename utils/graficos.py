@@ -1,69 +1,227 @@
-import plotly.express as px
+import numpy as np
+import plotly.graph_objects as go
 
 PALETA_CORES = [
     '#003366', '#1f77b4', '#3399ff', '#7fb3d5',
     '#005f99', '#66c2ff', '#2e86c1', '#154360'
 ]
+CORES_SEXO = {'Masculino': '#3399ff', 'Feminino': '#7fb3d5'}
+
+# Modelo de layout enxuto e compartilhado por todas as figuras (o modelo padrão ocupa ~7 KB do JSON
+# de cada gráfico). As figuras são montadas direto com graph_objects a partir de arrays NumPy
+TEMPLATE_PAINEL = go.layout.Template(layout=dict(
+    colorway=PALETA_CORES,
+    piecolorway=PALETA_CORES,
+    font=dict(size=12),
+    margin=dict(t=60, b=50, l=60, r=20),
+    plot_bgcolor='white',
+    xaxis=dict(automargin=True, gridcolor='#e5e5e5', zerolinecolor='#bbbbbb'),
+    yaxis=dict(automargin=True, gridcolor='#e5e5e5', zerolinecolor='#bbbbbb')
+))
+
+# Máximo de pontos por traço: acima disso os pontos são reduzidos de forma determinística
+MAX_PONTOS_TRACO = 500
+
+# Valores numéricos como array tipado compacto (float32 ou o menor inteiro que comporta os valores).
+# O plotly envia arrays NumPy codificados em binário (base64) em vez de listas JSON
+def compactar(valores):
+    valores = np.asarray(valores)
+    if valores.dtype.kind == 'f':
+        return valores.astype('float32')
+    if valores.dtype.kind in 'iu' and valores.size:
+        tipo = np.result_type(np.min_scalar_type(valores.min()), np.min_scalar_type(valores.max()))
+        return valores.astype(tipo if tipo.itemsize < 8 else 'float64')
+    return valores
+
+# Posições de no máximo `maximo` pontos igualmente espaçados, incluindo o primeiro e o último
+def indices_reduzidos(n, maximo=MAX_PONTOS_TRACO):
+    if n <= maximo:
+        return np.arange(n)
+    return np.linspace(0, n - 1, maximo).round().astype('int64')
+
+def nova_figura(titulo, **layout):
+    return go.Figure(layout=go.Layout(template=TEMPLATE_PAINEL, title=titulo, **layout))
 
 def ajustar_grafico_rosca(fig):
     fig.update_traces(
         textposition='outside',
         textfont_size=12,
         textinfo='label+percent',
-        hovertemplate='%{label}<br>Quantidade: %{value}<br>Porcentagem: %{percent}'
+        hovertemplate='%{label}<br>Quantidade: %{value}<br>Porcentagem: %{percent}<extra></extra>'
     )
     fig.update_layout(margin=dict(t=60, b=60, l=60, r=60), height=400)
     return fig
 
-def gerar_grafico_rosca(df, nome_coluna, valor_coluna, titulo):
-    contagem = df[nome_coluna].value_counts().reset_index()
-    contagem.columns = [nome_coluna, 'Quantidade']
-    fig = px.pie(
-        contagem,
-        names=nome_coluna,
-        values='Quantidade',
-        title=titulo,
+def gerar_grafico_rosca(contagem, nome_coluna, valor_coluna, titulo):
+    contagem = contagem[contagem[valor_coluna] > 0]
+    fig = nova_figura(titulo)
+    fig.add_trace(go.Pie(
+        labels=contagem[nome_coluna].astype(str).tolist(),
+        values=compactar(contagem[valor_coluna].to_numpy()),
         hole=0.4,
-        color_discrete_sequence=PALETA_CORES
-    )
+        sort=False,
+        marker=dict(colors=PALETA_CORES[:len(contagem)])
+    ))
     return ajustar_grafico_rosca(fig)
 
 def gerar_grafico_barra(df, x, y, color, titulo, legenda):
-    fig = px.bar(
-        df, x=x, y=y, color=color,
-        barmode='group',
-        title=titulo,
-        color_discrete_sequence=PALETA_CORES,
-        labels=legenda
+    fig = nova_figura(
+        titulo, barmode='group', height=450, xaxis_title=x, yaxis_title=y,
+        legend_title_text=legenda.get(color, color)
     )
-    fig.update_layout(xaxis_title=x, yaxis_title=y, height=450)
+    for grupo, dados in df.groupby(color, observed=True, sort=False):
+        fig.add_trace(go.Bar(
+            x=dados[x].astype(str).tolist(), y=compactar(dados[y].to_numpy()), name=str(grupo),
+            hovertemplate=f'{x}: %{{x}}<br>{y}: %{{y:.1f}}<extra>{grupo}</extra>'
+        ))
     return fig
 
-def gerar_piramide_etaria(df):
-    piramide = df.groupby(['TP_FAIXA_ETARIA', 'TP_SEXO']).size().reset_index(name='Quantidade')
-    piramide['Quantidade'] = piramide.apply(
-        lambda row: -row['Quantidade'] if row['TP_SEXO'] == 'Feminino' else row['Quantidade'], axis=1
+# Pirâmide a partir das contagens de contar_piramide: o lado feminino é negado de uma vez (np.where).
+# Com empilhar (ex.: 'TP_ESCOLA'), cada barra é dividida pelos valores dessa dimensão
+def gerar_piramide_etaria(piramide, empilhar=None):
+    chaves = ['TP_FAIXA_ETARIA', 'TP_SEXO'] + ([empilhar] if empilhar else [])
+    piramide = piramide.groupby(chaves, observed=True, as_index=False)['Quantidade'].sum()
+    quantidade = piramide['Quantidade'].to_numpy()
+    feminino = (piramide['TP_SEXO'] == 'Feminino').to_numpy()
+    piramide['Quantidade'] = np.where(feminino, -quantidade, quantidade)
+    grupos = piramide['TP_SEXO'].astype(str)
+    if empilhar:
+        grupos = grupos + ' · ' + piramide[empilhar].astype(str)
+
+    fig = nova_figura(
+        'Pirâmide Etária por Sexo', barmode='relative', height=500,
+        xaxis_title='Quantidade de Participantes', yaxis_title='Faixa Etária', legend_title_text='Grupo',
+        yaxis=dict(categoryorder='array', categoryarray=list(piramide['TP_FAIXA_ETARIA'].cat.categories))
     )
-    fig = px.bar(
-        piramide,
-        x='Quantidade',
-        y='TP_FAIXA_ETARIA',
-        color='TP_SEXO',
-        orientation='h',
-        title='Pirâmide Etária por Sexo',
-        color_discrete_map={'Masculino': '#3399ff', 'Feminino': '#7fb3d5'},
-        labels={'TP_FAIXA_ETARIA': 'Faixa Etária', 'Quantidade': 'Quantidade'}
+    for posicao, grupo in enumerate(grupos.unique()):
+        dados = piramide[(grupos == grupo).to_numpy()]
+        fig.add_trace(go.Bar(
+            x=compactar(dados['Quantidade'].to_numpy()), y=dados['TP_FAIXA_ETARIA'].astype(str).tolist(),
+            orientation='h', name=grupo,
+            marker_color=CORES_SEXO.get(grupo, PALETA_CORES[posicao % len(PALETA_CORES)]),
+            hovertemplate='%{y}<br>Quantidade: %{x}<extra>' + grupo + '</extra>'
+        ))
+    return fig
+
+# Violino montado a partir dos resumos de preparar_distribuicao: contorno da KDE, caixa com os
+# quartis, linha da média e a amostra de pontos com jitter (cada traço com no máximo max_pontos)
+def gerar_grafico_violino(distribuicao, x, y, titulo, legenda, max_pontos=MAX_PONTOS_TRACO):
+    fig = nova_figura(
+        titulo, xaxis_title=x, yaxis_title=y, height=450, legend_title_text=legenda.get(x, x),
+        xaxis=dict(
+            tickvals=list(range(len(distribuicao))), ticktext=[grupo['rotulo'] for grupo in distribuicao]
+        )
     )
-    fig.update_layout(height=500, xaxis_title='Quantidade de Participantes', yaxis_title='Faixa Etária')
+    gerador = np.random.default_rng(0)
+    for posicao, grupo in enumerate(distribuicao):
+        cor = PALETA_CORES[posicao % len(PALETA_CORES)]
+        escala = 0.4 / grupo['densidade'].max()
+        meia_largura = grupo['densidade'] * escala
+        contorno = indices_reduzidos(len(grupo['grade']), max_pontos // 2)
+        fig.add_trace(go.Scatter(
+            x=compactar(np.concatenate([posicao - meia_largura[contorno], (posicao + meia_largura[contorno])[::-1]])),
+            y=compactar(np.concatenate([grupo['grade'][contorno], grupo['grade'][contorno][::-1]])),
+            fill='toself', mode='lines', line=dict(color=cor, width=1),
+            name=grupo['rotulo'], legendgroup=grupo['rotulo'], hoverinfo='skip'
+        ))
+        fig.add_trace(go.Box(
+            x=[posicao], q1=[grupo['q1']], median=[grupo['mediana']], q3=[grupo['q3']],
+            lowerfence=[grupo['cerca_inferior']], upperfence=[grupo['cerca_superior']],
+            width=0.08, fillcolor='white', line=dict(color=cor, width=1),
+            name=grupo['rotulo'], legendgroup=grupo['rotulo'], showlegend=False
+        ))
+        largura_media = np.interp(grupo['media'], grupo['grade'], meia_largura)
+        fig.add_trace(go.Scatter(
+            x=[posicao - largura_media, posicao + largura_media], y=[grupo['media']] * 2,
+            mode='lines', line=dict(color=cor, dash='dash'),
+            name=grupo['rotulo'], legendgroup=grupo['rotulo'], showlegend=False,
+            hovertemplate=f"Média: {grupo['media']:.1f}<extra>{grupo['rotulo']}</extra>"
+        ))
+        amostra = grupo['amostra'][indices_reduzidos(len(grupo['amostra']), max_pontos)]
+        fig.add_trace(go.Scattergl(
+            x=compactar(posicao + 0.3 * (gerador.random(len(amostra)) - 0.5)), y=compactar(amostra),
+            mode='markers', marker=dict(color=cor, size=3, opacity=0.5),
+            name=grupo['rotulo'], legendgroup=grupo['rotulo'], showlegend=False, hoverinfo='y'
+        ))
     return fig
 
-def gerar_grafico_violino(df, x, y, titulo, legenda):
-    fig = px.violin(
-        df, x=x, y=y, box=True, points='all', color=x,
-        color_discrete_sequence=PALETA_CORES,
-        title=titulo,
-        labels=legenda
+# Diferença Privada - Pública por disciplina, com o intervalo de confiança como barra de erro
+def gerar_grafico_comparacao(comparacao, titulo):
+    diferenca = comparacao['Diferença'].to_numpy()
+    fig = nova_figura(
+        titulo, height=400, xaxis_title='Diferença de Médias (Privada - Pública)', yaxis_title='Disciplina'
     )
-    fig.update_traces(meanline_visible=True, jitter=0.3, marker=dict(size=3, opacity=0.5))
-    fig.update_layout(xaxis_title=x, yaxis_title=y, height=450)
-    return fig
\ No newline at end of file
+    fig.add_trace(go.Scatter(
+        x=compactar(diferenca),
+        y=comparacao['Disciplina'].tolist(),
+        mode='markers',
+        marker=dict(color=PALETA_CORES[1], size=10),
+        error_x=dict(
+            type='data', symmetric=False,
+            array=compactar(comparacao['IC Superior'].to_numpy() - diferenca),
+            arrayminus=compactar(diferenca - comparacao['IC Inferior'].to_numpy())
+        ),
+        customdata=compactar(comparacao['d de Cohen'].to_numpy()),
+        hovertemplate='%{y}<br>Diferença: %{x:.1f}<br>d de Cohen: %{customdata:.2f}<extra></extra>'
+    ))
+    fig.add_vline(x=0, line_dash='dash', line_color='gray')
+    return fig
+
+# Ranking de regiões por uma medida (barras horizontais), coloridas pela diferença Privada - Pública.
+# Com limite, mostra apenas as primeiras regiões da ordenação
+def gerar_ranking_regioes(regioes, coluna_regiao, medida, titulo, legenda, limite=None):
+    regioes = regioes.dropna(subset=[medida]).sort_values(medida, ascending=False)
+    if limite is not None:
+        regioes = regioes.head(limite)
+    # Ordem invertida: o plotly desenha a primeira categoria embaixo
+    regioes = regioes.iloc[::-1]
+    fig = nova_figura(
+        titulo, height=max(400, 22 * len(regioes)),
+        yaxis_title=legenda.get(coluna_regiao, coluna_regiao), xaxis_title=legenda.get(medida, medida)
+    )
+    fig.add_trace(go.Bar(
+        x=compactar(regioes[medida].to_numpy()),
+        y=regioes[coluna_regiao].astype(str).tolist(),
+        orientation='h',
+        marker=dict(
+            color=compactar(regioes['DIFERENCA_ESCOLAS'].to_numpy()), colorscale='Blues',
+            colorbar=dict(title=legenda.get('DIFERENCA_ESCOLAS', 'DIFERENCA_ESCOLAS'))
+        ),
+        customdata=compactar(regioes[['QUANTIDADE', 'MEDIA_NOTAS', 'DIFERENCA_ESCOLAS']].to_numpy('float64')),
+        hovertemplate=(
+            '%{y}<br>Participantes: %{customdata[0]:.0f}<br>Média: %{customdata[1]:.1f}'
+            '<br>Diferença Privada - Pública: %{customdata[2]:.1f}<extra></extra>'
+        )
+    ))
+    return fig
+
+# Figuras do painel que saem do cubo (roscas e disciplinas), a partir de calcular_resumo_graficos.
+# As tarefas do app e os relatórios em lote montam as figuras por aqui, para que mostrem os mesmos gráficos
+def gerar_figuras_resumo(resumo):
+    return {
+        'escola': gerar_grafico_rosca(resumo['escola'], 'TP_ESCOLA', 'Quantidade', 'Tipo de Escola'),
+        'dependencia': gerar_grafico_rosca(
+            resumo['dependencia'], 'TP_DEPENDENCIA_ADM_ESC', 'Quantidade', 'Dependência Administrativa'
+        ),
+        'disciplinas': gerar_grafico_barra(
+            resumo['disciplinas'], 'Disciplina', 'Média', 'TP_ESCOLA',
+            'Média por Disciplina e Tipo de Escola',
+            {'TP_ESCOLA': 'Tipo de Escola'}
+        )
+    }
+
+# Violino da média das provas por tipo de escola, a partir de calcular_distribuicao_graficos
+def gerar_figura_violino(distribuicao):
+    return gerar_grafico_violino(
+        distribuicao, 'TP_ESCOLA', 'MEDIA_NOTAS',
+        'Distribuição da Média das Provas por Tipo de Escola (Gráfico Violino)',
+        {'TP_ESCOLA': 'Tipo de Escola', 'MEDIA_NOTAS': 'Média das Notas'}
+    )
+
+# Todas as figuras do painel principal a partir de calcular_dados_graficos (relatórios em lote)
+def gerar_figuras_painel(graficos, empilhar=None):
+    return {
+        'piramide': gerar_piramide_etaria(graficos['piramide'], empilhar),
+        **gerar_figuras_resumo(graficos),
+        'violino': gerar_figura_violino(graficos['distribuicao'])
+    }
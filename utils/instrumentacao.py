@@ -0,0 +1,103 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+# Instrumentação das etapas de cada execução do app: tempo, linhas, memória alocada e bytes enviados.
+# A coleta só existe entre iniciar_coleta e finalizar_coleta (por sessão/thread, via ContextVar);
+# fora dela, medir e cronometrado custam uma leitura de ContextVar
+ATIVA_POR_PADRAO = os.environ.get('ENEM_INSTRUMENTACAO') == '1'
+# Arquivo JSON Lines onde cada execução instrumentada é acrescentada (opcional)
+ARQUIVO_METRICAS = os.environ.get('ENEM_METRICAS')
+
+registro_log = logging.getLogger(__name__)
+_coleta = contextvars.ContextVar('coleta', default=None)
+_nivel = contextvars.ContextVar('nivel', default=0)
+
+# Tempos de partida do processo (importações e primeira execução do app), cada um registrado uma vez
+PARTIDA = {}
+
+# Registra os tempos ainda não registrados (no log e no arquivo de métricas) e devolve todos
+def registrar_partida(**tempos):
+    novos = {nome: valor for nome, valor in tempos.items() if nome not in PARTIDA}
+    if novos:
+        PARTIDA.update(novos)
+        linha = json.dumps({'instante': time.time(), 'partida': novos}, ensure_ascii=False)
+        registro_log.info(linha)
+        if ARQUIVO_METRICAS:
+            with open(ARQUIVO_METRICAS, 'a', encoding='utf-8') as arquivo:
+                arquivo.write(linha + '\n')
+    return PARTIDA
+
+def iniciar_coleta():
+    _coleta.set([])
+
+def coleta_ativa():
+    return _coleta.get() is not None
+
+# Mede uma etapa. Entrega o registro (dict) para o chamador anotar linhas, bytes etc., ou None
+# quando a coleta está desligada. Os registros ficam na ordem de início, com o nível de aninhamento;
+# com tracemalloc ligado, registram também a memória alocada que a etapa manteve
+@contextlib.contextmanager
+def medir(etapa, **anotacoes):
+    etapas = _coleta.get()
+    if etapas is None:
+        yield None
+        return
+    nivel = _nivel.get()
+    registro = {'etapa': etapa, 'nivel': nivel, **anotacoes}
+    etapas.append(registro)
+    memoria = tracemalloc.is_tracing()
+    if memoria:
+        inicial = tracemalloc.get_traced_memory()[0]
+    token = _nivel.set(nivel + 1)
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    finally:
+        registro['ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+        _nivel.reset(token)
+        if memoria:
+            registro['alocado_mb'] = round((tracemalloc.get_traced_memory()[0] - inicial) / 2 ** 20, 3)
+
+# Acrescenta anotações a um registro de medir (sem efeito com a coleta desligada)
+def anotar(registro, **valores):
+    if registro is not None:
+        registro.update(valores)
+
+# Decorador equivalente a envolver a função em medir(etapa)
+def cronometrado(etapa):
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            if _coleta.get() is None:
+                return funcao(*args, **kwargs)
+            with medir(etapa):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+# Encerra a coleta da execução: registra uma linha JSON no log (e no arquivo de métricas, se
+# configurado) e devolve as etapas medidas
+def finalizar_coleta(**contexto):
+    etapas = _coleta.get()
+    _coleta.set(None)
+    if etapas is None:
+        return []
+    linha = json.dumps({'instante': time.time(), **contexto, 'etapas': etapas}, ensure_ascii=False, default=str)
+    registro_log.info(linha)
+    if ARQUIVO_METRICAS:
+        with open(ARQUIVO_METRICAS, 'a', encoding='utf-8') as arquivo:
+            arquivo.write(linha + '\n')
+    return etapas
+
+# Liga ou desliga o rastreamento de alocações (global ao processo: afeta todas as sessões)
+def rastrear_memoria(ligar):
+    if ligar and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    elif not ligar and tracemalloc.is_tracing():
+        tracemalloc.stop()
@@ -0,0 +1,97 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from utils.comparacao import NIVEL_CONFIANCA, comparacao_escolas
+from utils.graficos import (
+    gerar_figura_violino, gerar_figuras_resumo, gerar_grafico_comparacao, gerar_ranking_regioes
+)
+from utils.processamento import (
+    CacheLRU, calcular_distribuicao_graficos, calcular_resumo_graficos, carregar_regioes, versao_edicao
+)
+
+# Montagem concorrente do painel: cada bloco de gráficos é uma tarefa num pool de threads, iniciada
+# assim que o recorte é conhecido. As tarefas ficam num cache de Futures, então o mesmo recorte
+# devolve a mesma tarefa (em andamento ou concluída) para qualquer sessão ou fragmento que a peça
+EXECUTOR_PAINEL = ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) + 4), thread_name_prefix='painel')
+CACHE_TAREFAS = CacheLRU(capacidade=256, validade=3600)
+
+LEGENDA_REGIOES = {
+    'SG_UF_ESC': 'Estado', 'NO_MUNICIPIO_ESC': 'Município', 'MEDIA_NOTAS': 'Média das Notas',
+    'QUANTIDADE': 'Participantes', 'DIFERENCA_ESCOLAS': 'Diferença Privada - Pública'
+}
+
+# Roda uma tarefa com o ScriptRunContext da execução que a agendou (None fora do Streamlit), para
+# que os caches do Streamlit chamados na thread do pool tenham o contexto que esperam
+def executar(contexto_streamlit, calcular, *args):
+    if contexto_streamlit is not None:
+        add_script_run_ctx(threading.current_thread(), contexto_streamlit)
+    return calcular(*args)
+
+# Future da tarefa `calcular(*args)`, criada só na primeira vez que a chave é pedida. A tarefa roda
+# no contexto de quem a agendou (a instrumentação da execução continua valendo dentro dela)
+def agendar(chave, calcular, *args):
+    contexto = contextvars.copy_context()
+    contexto_streamlit = get_script_run_ctx(suppress_warning=True)
+    return CACHE_TAREFAS.obter(
+        chave, lambda: EXECUTOR_PAINEL.submit(contexto.run, executar, contexto_streamlit, calcular, *args)
+    )
+
+# Resultado de uma tarefa; se ela falhou, é descartada do cache para que o próximo pedido tente de novo
+def resultado(chave, calcular, *args):
+    futuro = agendar(chave, calcular, *args)
+    try:
+        return futuro.result()
+    except Exception:
+        CACHE_TAREFAS.descartar(chave)
+        raise
+
+# Tarefas do painel. Cada uma devolve dados e figuras prontos para exibir
+def montar_resumo(ano, sexo, escola, estado, municipio):
+    dados = calcular_resumo_graficos(ano, sexo, escola, estado, municipio)
+    return {'piramide': dados['piramide'], **gerar_figuras_resumo(dados)}
+
+def montar_violino(ano, sexo, escola, estado, municipio):
+    return gerar_figura_violino(calcular_distribuicao_graficos(ano, sexo, escola, estado, municipio))
+
+def montar_comparacao(ano, sexo, estado, municipio):
+    comparacao = comparacao_escolas(ano, sexo, estado, municipio)
+    figura = gerar_grafico_comparacao(
+        comparacao, f'Diferença de Médias com IC de {NIVEL_CONFIANCA:.0%} (bootstrap)'
+    )
+    return comparacao, figura
+
+def montar_regioes(ano, estado, medida):
+    if estado == 'Todos':
+        return gerar_ranking_regioes(
+            carregar_regioes(ano, 'uf'), 'SG_UF_ESC', medida, 'Ranking dos Estados', LEGENDA_REGIOES
+        )
+    municipios = carregar_regioes(ano, 'municipio')
+    return gerar_ranking_regioes(
+        municipios[municipios['SG_UF_ESC'] == estado], 'NO_MUNICIPIO_ESC', medida,
+        f'Ranking dos Municípios de {estado} (30 primeiros)', LEGENDA_REGIOES, limite=30
+    )
+
+# Chaves das tarefas: a versão dos dados do recorte (da edição, ou da UF filtrada) entra em todas,
+# então partições refeitas ou que receberam linhas geram tarefas novas só para os recortes afetados
+def chave_resumo(ano, sexo, escola, estado, municipio):
+    return ('resumo', versao_edicao(ano, estado=estado), sexo, escola, estado, municipio)
+
+def chave_violino(ano, sexo, escola, estado, municipio):
+    return ('violino', versao_edicao(ano, estado=estado), sexo, escola, estado, municipio)
+
+def chave_comparacao(ano, sexo, estado, municipio):
+    return ('comparacao', versao_edicao(ano, estado=estado), sexo, estado, municipio)
+
+def chave_regioes(ano, estado, medida):
+    return ('regioes', versao_edicao(ano, estado=estado), estado, medida)
+
+# Agenda todas as tarefas do recorte de uma vez, para que rodem em paralelo enquanto a página é montada
+def iniciar_painel(ano, sexo, escola, estado, municipio, medida_regiao):
+    agendar(chave_resumo(ano, sexo, escola, estado, municipio), montar_resumo, ano, sexo, escola, estado, municipio)
+    agendar(chave_violino(ano, sexo, escola, estado, municipio), montar_violino, ano, sexo, escola, estado, municipio)
+    agendar(chave_comparacao(ano, sexo, estado, municipio), montar_comparacao, ano, sexo, estado, municipio)
+    agendar(chave_regioes(ano, estado, medida_regiao), montar_regioes, ano, estado, medida_regiao)
@@ -0,0 +1,198 @@
+import functools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.processamento import (
+    ANO_PADRAO, DECODIFICACAO, DIRETORIO_DADOS, LEGENDA_MEDIDAS, MEDIDAS, TIPOS_CSV, TAMANHO_BLOCO,
+    carregar_cubo, carregar_dados, carregar_indice, decodificar, mapear_edicao, selecionar_linhas,
+    versao_edicao
+)
+
+# Previsão das notas (cada prova e MEDIA_NOTAS) a partir do perfil do participante: tipo e dependência
+# da escola, UF, faixa etária e sexo. Atributos codificados em one-hot com as categorias fixas da
+# camada de decodificação; um SGDRegressor por nota, treinado com partial_fit em blocos embaralhados
+# (o treino nunca materializa a edição inteira e roda fora do app: python -m utils.predicao [ano]).
+# O scikit-learn e o joblib só são importados ao treinar ou carregar o modelo: o app exibe as métricas
+# do arquivo JSON gravado ao lado do modelo e só carrega o modelo quando uma previsão é pedida
+ATRIBUTOS = ['TP_ESCOLA', 'TP_DEPENDENCIA_ADM_ESC', 'SG_UF_ESC', 'TP_FAIXA_ETARIA', 'TP_SEXO']
+DIRETORIO_MODELOS = os.path.join(DIRETORIO_DADOS, 'modelos')
+N_EPOCAS = 3
+FRACAO_VALIDACAO = 0.05
+
+def caminho_modelo(ano):
+    return os.path.join(DIRETORIO_MODELOS, f'notas_{ano}.joblib')
+
+def caminho_metricas(ano):
+    return os.path.join(DIRETORIO_MODELOS, f'notas_{ano}.json')
+
+def criar_codificador():
+    from sklearn.preprocessing import OneHotEncoder
+
+    categorias = [list(DECODIFICACAO[atributo].values()) for atributo in ATRIBUTOS]
+    codificador = OneHotEncoder(categories=categorias, handle_unknown='ignore', dtype=np.float32)
+    return codificador.fit(pd.DataFrame([[lista[0] for lista in categorias]], columns=ATRIBUTOS))
+
+# Linhas cujos atributos estão todos preenchidos (as demais ficam sem previsão)
+def atributos_completos(bloco):
+    return bloco[ATRIBUTOS].notna().all(axis=1).to_numpy()
+
+# Treina o modelo de uma edição sobre as colunas mapeadas em memória. As notas são padronizadas com
+# média e desvio do cubo (sem ler as linhas), e uma fração fixa das linhas fica de fora para validação
+def treinar_modelo(ano=ANO_PADRAO, limite_linhas=None, tamanho_bloco=TAMANHO_BLOCO, epocas=N_EPOCAS, semente=42):
+    import joblib
+    from sklearn.linear_model import SGDRegressor
+
+    versao = versao_edicao(ano, limite_linhas)
+    df = mapear_edicao(ano, versao)
+    cubo = carregar_cubo(ano, limite_linhas)
+    quantidade = cubo['QUANTIDADE'].sum()
+    medias = {medida: cubo[f'SOMA_{medida}'].sum() / quantidade for medida in MEDIDAS}
+    desvios = {
+        medida: np.sqrt(cubo[f'SOMA_QUADRADOS_{medida}'].sum() / quantidade - medias[medida] ** 2)
+        for medida in MEDIDAS
+    }
+
+    gerador = np.random.default_rng(semente)
+    ordem = gerador.permutation(len(df))
+    n_validacao = int(len(df) * FRACAO_VALIDACAO)
+    validacao, treino = ordem[:n_validacao], ordem[n_validacao:]
+    codificador = criar_codificador()
+    regressores = {medida: SGDRegressor(alpha=1e-6, random_state=semente) for medida in MEDIDAS}
+
+    inicio = time.perf_counter()
+    for _ in range(epocas):
+        gerador.shuffle(treino)
+        for posicao in range(0, len(treino), tamanho_bloco):
+            linhas = np.sort(treino[posicao:posicao + tamanho_bloco])
+            bloco = df.take(linhas)
+            matriz = codificador.transform(bloco[ATRIBUTOS])
+            for medida, regressor in regressores.items():
+                alvo = (bloco[medida].to_numpy(dtype='float64') - medias[medida]) / desvios[medida]
+                regressor.partial_fit(matriz, alvo)
+
+    modelo = {
+        'ano': ano, 'versao': versao, 'atributos': ATRIBUTOS,
+        'codificador': codificador, 'regressores': regressores, 'medias': medias, 'desvios': desvios,
+        'linhas_treino': len(treino), 'segundos_treino': round(time.perf_counter() - inicio, 2)
+    }
+    previsto = prever_bloco(modelo, df.take(np.sort(validacao)))
+    real = df.take(np.sort(validacao))
+    modelo['r2_validacao'] = {
+        medida: float(1 - np.mean((real[medida] - previsto[f'PREVISTO_{medida}']) ** 2) / np.var(real[medida]))
+        for medida in MEDIDAS
+    }
+    os.makedirs(DIRETORIO_MODELOS, exist_ok=True)
+    temporario = f'{caminho_modelo(ano)}.tmp{os.getpid()}'
+    joblib.dump(modelo, temporario)
+    os.replace(temporario, caminho_modelo(ano))
+    with open(caminho_metricas(ano), 'w', encoding='utf-8') as arquivo:
+        json.dump(metricas_modelo(modelo), arquivo, ensure_ascii=False)
+    return modelo
+
+# Métricas do modelo (sem os estimadores), gravadas em JSON ao lado dele
+def metricas_modelo(modelo):
+    return {chave: modelo.get(chave) for chave in ('ano', 'versao', 'r2_validacao', 'linhas_treino', 'segundos_treino')}
+
+# Modelo persistido de uma edição (None se ainda não foi treinado). Como em ler_manifesto, o cache é
+# chaveado pelo inode e pela data de modificação do arquivo: um modelo treinado com o app no ar é
+# carregado na próxima previsão, e a ausência do modelo não fica em cache
+def carregar_modelo(ano=ANO_PADRAO):
+    try:
+        info = os.stat(caminho_modelo(ano))
+    except FileNotFoundError:
+        return None
+    return ler_modelo(caminho_modelo(ano), info.st_ino, info.st_mtime_ns)
+
+@functools.lru_cache(maxsize=4)
+def ler_modelo(caminho, inode, modificacao):
+    import joblib
+    return joblib.load(caminho)
+
+# Métricas do modelo de uma edição sem carregá-lo; None sem modelo. Um modelo gravado sem o JSON é
+# carregado uma vez e o JSON é gravado
+def ler_metricas_modelo(ano=ANO_PADRAO):
+    if os.path.exists(caminho_metricas(ano)):
+        with open(caminho_metricas(ano), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    modelo = carregar_modelo(ano)
+    if modelo is None:
+        return None
+    with open(caminho_metricas(ano), 'w', encoding='utf-8') as arquivo:
+        json.dump(metricas_modelo(modelo), arquivo, ensure_ascii=False)
+    return metricas_modelo(modelo)
+
+# Previsões de um bloco já decodificado: uma coluna PREVISTO_<nota> por nota, NaN sem atributos completos
+def prever_bloco(modelo, bloco):
+    completos = atributos_completos(bloco)
+    previsoes = pd.DataFrame(index=bloco.index)
+    # Sem linhas completas não há o que codificar (o codificador não aceita zero linhas)
+    matriz = modelo['codificador'].transform(bloco.loc[completos, ATRIBUTOS]) if completos.any() else None
+    for medida, regressor in modelo['regressores'].items():
+        valores = np.full(len(bloco), np.nan, dtype='float32')
+        if matriz is not None:
+            valores[completos] = regressor.predict(matriz) * modelo['desvios'][medida] + modelo['medias'][medida]
+        previsoes[f'PREVISTO_{medida}'] = valores
+    return previsoes
+
+# Previsões para linhas de uma edição (posições de selecionar_linhas; None = todas), em blocos.
+# Um recorte vazio devolve as colunas de previsão sem linhas
+def prever_linhas(modelo, df, posicoes=None, tamanho_bloco=TAMANHO_BLOCO):
+    posicoes = np.arange(len(df)) if posicoes is None else posicoes
+    if len(posicoes) == 0:
+        return prever_bloco(modelo, df.iloc[:0]).reset_index(drop=True)
+    return pd.concat(
+        [prever_bloco(modelo, df.take(posicoes[inicio:inicio + tamanho_bloco]))
+         for inicio in range(0, len(posicoes), tamanho_bloco)],
+        ignore_index=True
+    )
+
+# Média observada, média prevista e erro quadrático médio de cada nota no recorte da barra lateral
+def resumir_previsoes_recorte(modelo, ano, sexo='Todos', escola='Todos', estado='Todos', municipio='Todos',
+                              limite_linhas=None):
+    ufs = None if estado == 'Todos' else [estado]
+    df = carregar_dados(ano, ufs, limite_linhas)
+    posicoes = selecionar_linhas(carregar_indice(ano, ufs, limite_linhas), sexo, escola, estado, municipio)
+    posicoes = np.arange(len(df)) if posicoes is None else posicoes
+    previsoes = prever_linhas(modelo, df, posicoes)
+    linhas = []
+    for medida in MEDIDAS:
+        real = df[medida].to_numpy()[posicoes].astype('float64')
+        previsto = previsoes[f'PREVISTO_{medida}'].to_numpy(dtype='float64')
+        linhas.append({
+            'Disciplina': LEGENDA_MEDIDAS[medida], 'Média Observada': real.mean() if len(real) else np.nan,
+            'Média Prevista': previsto.mean() if len(real) else np.nan,
+            'Erro Quadrático Médio (raiz)': np.sqrt(np.mean((real - previsto) ** 2)) if len(real) else np.nan
+        })
+    return pd.DataFrame(linhas)
+
+# Atributos de um bloco de CSV no formato do INEP: códigos numéricos ausentes ou fora da tabela viram NaN
+def decodificar_atributos(bloco):
+    for atributo in ATRIBUTOS:
+        serie = bloco[atributo]
+        if not isinstance(serie.dtype, pd.CategoricalDtype):
+            serie = serie.fillna(0)
+        bloco[atributo] = decodificar(serie)
+    return bloco
+
+# Previsões para um CSV enviado (arquivo ou buffer), lido em blocos só com os atributos necessários.
+# Gera um DataFrame por bloco, com as colunas originais dos atributos e as previsões
+def prever_csv(modelo, arquivo, tamanho_bloco=TAMANHO_BLOCO):
+    leitor = pd.read_csv(
+        arquivo, sep=';', encoding='latin1', usecols=ATRIBUTOS,
+        dtype={atributo: TIPOS_CSV[atributo] for atributo in ATRIBUTOS}, chunksize=tamanho_bloco
+    )
+    for bloco in leitor:
+        bloco = decodificar_atributos(bloco)
+        yield pd.concat([bloco, prever_bloco(modelo, bloco)], axis=1)
+
+# Treina o modelo das edições informadas (ou da padrão): python -m utils.predicao [ano ...]
+if __name__ == '__main__':
+    for ano in [int(argumento) for argumento in sys.argv[1:]] or [ANO_PADRAO]:
+        modelo = treinar_modelo(ano)
+        r2 = ', '.join(f'{medida}={valor:.3f}' for medida, valor in modelo['r2_validacao'].items())
+        print(f"{ano}: {modelo['linhas_treino']} linhas em {modelo['segundos_treino']} s; R² de validação: {r2}")
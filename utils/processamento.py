@@ -1,55 +1,832 @@
+import contextlib
+import copy
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
+from pandas.api.types import union_categoricals
 import streamlit as st
 
-@st.cache_data
-def carregar_dados():
-    df = pd.read_csv('dados/enem_tratado.csv', sep=';', encoding='latin1', nrows=5000000)
-
-    # Seleção e limpeza das colunas
-    df = df.filter(items=[
-        'TP_ESCOLA', 'NU_NOTA_MT', 'NU_NOTA_CN', 'NU_NOTA_CH', 'NU_NOTA_LC', 'NU_NOTA_REDACAO',
-        'TP_FAIXA_ETARIA', 'TP_SEXO', 'NO_MUNICIPIO_ESC', 'SG_UF_ESC', 'TP_DEPENDENCIA_ADM_ESC'
-    ]).dropna()
-
-    # Faixa etária categorizada
-    df['TP_FAIXA_ETARIA'] = df['TP_FAIXA_ETARIA'].astype(str).replace({
-        '1': 'Menor de 17 anos', '2': '17 anos', '3': '18 anos', '4': '19 anos', '5': '20 anos',
-        '6': '21 anos', '7': '22 anos', '8': '23 anos', '9': '24 anos', '10': '25 anos',
-        '11': 'Entre 26 e 30 anos', '12': 'Entre 31 e 35 anos', '13': 'Entre 36 e 40 anos',
-        '14': 'Entre 41 e 45 anos', '15': 'Entre 46 e 50 anos', '16': 'Entre 51 e 55 anos',
-        '17': 'Entre 56 e 60 anos', '18': 'Entre 61 e 65 anos', '19': 'Entre 66 e 70 anos',
-        '20': 'Maior de 70 anos'
+from utils.instrumentacao import anotar, medir
+
+# Edições: dados/enem_tratado.csv é a de 2023; as demais seguem dados/enem_tratado_<ano>.csv
+DIRETORIO_DADOS = 'dados'
+CAMINHO_CSV = 'dados/enem_tratado.csv'
+PADRAO_CSV_EDICAO = re.compile(r'enem_tratado_(\d{4})\.csv')
+ANO_PADRAO = 2023
+
+# Armazenamento por edição em dados/particoes/ano=<ano>/: uma coluna por arquivo .npy, com as linhas
+# ordenadas por UF (cada UF é um intervalo contíguo), mapeadas em memória somente leitura. Todas as
+# sessões e processos do host compartilham as mesmas páginas, sem cópia por sessão
+DIRETORIO_PARTICOES = 'dados/particoes'
+MAX_EDICOES_MAPEADAS = 8
+# Lotes de linhas anexados a uma edição (anexar_incremento), em dados/incrementos/ano=<ano>/, na
+# ordem em que foram anexados; o reparticionamento completo lê o CSV da edição e depois cada lote
+DIRETORIO_INCREMENTOS = 'dados/incrementos'
+
+# Incrementar sempre que o tratamento dos dados mudar, para invalidar as partições geradas
+VERSAO_PIPELINE = '11'
+
+TAMANHO_BLOCO = 500000
+
+N_CLUSTERS = 3
+# A média de cinco notas com uma casa decimal é múltipla de 0,02: o histograma nessa resolução é exato
+RESOLUCAO_CLUSTER = 0.01
+
+NOTAS = ['NU_NOTA_MT', 'NU_NOTA_CN', 'NU_NOTA_CH', 'NU_NOTA_LC', 'NU_NOTA_REDACAO']
+COLUNAS = [
+    'TP_ESCOLA', 'NU_NOTA_MT', 'NU_NOTA_CN', 'NU_NOTA_CH', 'NU_NOTA_LC', 'NU_NOTA_REDACAO',
+    'TP_FAIXA_ETARIA', 'TP_SEXO', 'NO_MUNICIPIO_ESC', 'SG_UF_ESC', 'TP_DEPENDENCIA_ADM_ESC'
+]
+
+FAIXAS_ETARIAS = {
+    1: 'Menor de 17 anos', 2: '17 anos', 3: '18 anos', 4: '19 anos', 5: '20 anos',
+    6: '21 anos', 7: '22 anos', 8: '23 anos', 9: '24 anos', 10: '25 anos',
+    11: 'Entre 26 e 30 anos', 12: 'Entre 31 e 35 anos', 13: 'Entre 36 e 40 anos',
+    14: 'Entre 41 e 45 anos', 15: 'Entre 46 e 50 anos', 16: 'Entre 51 e 55 anos',
+    17: 'Entre 56 e 60 anos', 18: 'Entre 61 e 65 anos', 19: 'Entre 66 e 70 anos',
+    20: 'Maior de 70 anos'
+}
+SEXOS = {'M': 'Masculino', 'F': 'Feminino'}
+DEPENDENCIAS = {1: 'Federal', 2: 'Estadual', 3: 'Municipal', 4: 'Privada'}
+TIPOS_ESCOLA = {2: 'Pública', 3: 'Privada'}
+ESCOLA_NAO_RESPONDEU = 1
+UFS = [
+    'AC', 'AL', 'AM', 'AP', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MG', 'MS', 'MT', 'PA',
+    'PB', 'PE', 'PI', 'PR', 'RJ', 'RN', 'RO', 'RR', 'RS', 'SC', 'SE', 'SP', 'TO'
+]
+
+# Camada de decodificação: código bruto -> rótulo. Códigos textuais (sexo, UF) chegam do CSV
+# como categorias fixas; os numéricos passam por uma tabela de consulta indexada pelo próprio código
+DECODIFICACAO = {
+    'TP_FAIXA_ETARIA': FAIXAS_ETARIAS,
+    'TP_SEXO': SEXOS,
+    'TP_DEPENDENCIA_ADM_ESC': DEPENDENCIAS,
+    'TP_ESCOLA': TIPOS_ESCOLA,
+    'SG_UF_ESC': {uf: uf for uf in UFS}
+}
+COLUNAS_ORDENADAS = ['TP_FAIXA_ETARIA']
+
+# Tabela de 256 posições: código bruto (como uint8) -> posição do rótulo, -1 se desconhecido
+def tabela_consulta(mapa):
+    tabela = np.full(256, -1, dtype='int8')
+    tabela[list(mapa)] = np.arange(len(mapa))
+    return tabela
+
+TABELAS_CONSULTA = {
+    coluna: tabela_consulta(mapa) for coluna, mapa in DECODIFICACAO.items()
+    if isinstance(next(iter(mapa)), int)
+}
+
+# Tipos declarados na leitura do CSV: códigos inteiros, notas em float32 e textos categóricos
+TIPOS_CSV = {
+    'TP_ESCOLA': 'Int8', 'TP_FAIXA_ETARIA': 'Int8', 'TP_DEPENDENCIA_ADM_ESC': 'Int8',
+    'TP_SEXO': pd.CategoricalDtype(list(SEXOS)), 'SG_UF_ESC': pd.CategoricalDtype(UFS),
+    'NO_MUNICIPIO_ESC': 'category',
+    **{nota: 'float32' for nota in NOTAS}
+}
+
+# Converte a coluna de códigos em Categorical com os rótulos, sem construir strings por linha
+def decodificar(serie):
+    mapa = DECODIFICACAO[serie.name]
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        posicoes = serie.cat.codes.to_numpy()
+    else:
+        posicoes = TABELAS_CONSULTA[serie.name][serie.to_numpy(dtype='int8').view('uint8')]
+    return pd.Categorical.from_codes(
+        posicoes, categories=list(mapa.values()), ordered=serie.name in COLUNAS_ORDENADAS
+    )
+
+# Recupera os códigos brutos (inteiros do INEP) de uma coluna decodificada
+def codigos_brutos(serie):
+    return np.array(list(DECODIFICACAO[serie.name]))[serie.cat.codes.to_numpy()]
+
+# Impressão digital do CSV de origem (tamanho, data de modificação, limite de linhas e versão do pipeline)
+def impressao_digital(caminho, limite_linhas=None):
+    if not os.path.exists(caminho):
+        return None
+    info = os.stat(caminho)
+    chave = f'{VERSAO_PIPELINE}:{info.st_size}:{info.st_mtime_ns}:{limite_linhas}'
+    return hashlib.sha1(chave.encode()).hexdigest()
+
+# CSVs de origem disponíveis, por ano
+def fontes_csv():
+    fontes = {}
+    if os.path.exists(CAMINHO_CSV):
+        fontes[ANO_PADRAO] = CAMINHO_CSV
+    if os.path.isdir(DIRETORIO_DADOS):
+        for nome in os.listdir(DIRETORIO_DADOS):
+            encontrado = PADRAO_CSV_EDICAO.fullmatch(nome)
+            if encontrado:
+                fontes[int(encontrado.group(1))] = os.path.join(DIRETORIO_DADOS, nome)
+    return fontes
+
+def diretorio_edicao(ano):
+    return os.path.join(DIRETORIO_PARTICOES, f'ano={ano}')
+
+# Manifesto de uma edição, relido só quando o arquivo muda (o dicionário é compartilhado: não alterar)
+def ler_manifesto(ano):
+    caminho = os.path.join(diretorio_edicao(ano), 'manifesto.json')
+    try:
+        info = os.stat(caminho)
+    except FileNotFoundError:
+        return None
+    return ler_json(caminho, info.st_ino, info.st_mtime_ns)
+
+@functools.lru_cache(maxsize=MAX_EDICOES_MAPEADAS)
+def ler_json(caminho, inode, modificacao):
+    with open(caminho, encoding='utf-8') as arquivo:
+        return json.load(arquivo)
+
+def diretorio_incrementos(ano):
+    return os.path.join(DIRETORIO_INCREMENTOS, f'ano={ano}')
+
+# Lotes anexados a uma edição, na ordem de anexação
+def arquivos_incrementos(ano):
+    diretorio = diretorio_incrementos(ano)
+    if not os.path.isdir(diretorio):
+        return []
+    return [os.path.join(diretorio, nome) for nome in sorted(os.listdir(diretorio)) if nome.endswith('.csv')]
+
+# Edições disponíveis, da mais recente para a mais antiga: com CSV de origem ou já particionadas
+def edicoes_disponiveis():
+    anos = set(fontes_csv())
+    if os.path.isdir(DIRETORIO_PARTICOES):
+        anos.update(int(nome[4:]) for nome in os.listdir(DIRETORIO_PARTICOES) if re.fullmatch(r'ano=\d+', nome))
+    return sorted(anos, reverse=True)
+
+# Grava cada coluna em .npy (categóricas como códigos) e devolve o esquema para reconstruí-las
+def gravar_colunas(df, diretorio):
+    os.makedirs(diretorio)
+    esquema = {}
+    for coluna in df.columns:
+        if isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            np.save(os.path.join(diretorio, f'{coluna}.npy'), df[coluna].cat.codes.to_numpy())
+            esquema[coluna] = {
+                'categorias': df[coluna].cat.categories.tolist(), 'ordenada': bool(df[coluna].cat.ordered)
+            }
+        else:
+            np.save(os.path.join(diretorio, f'{coluna}.npy'), df[coluna].to_numpy())
+            esquema[coluna] = None
+    return esquema
+
+# Intervalo de linhas de cada UF numa edição ordenada por UF
+def limites_particoes(df):
+    limites = np.cumsum(np.bincount(df['SG_UF_ESC'].cat.codes, minlength=len(UFS)))
+    return {
+        uf: [int(fim - quantidade), int(fim)]
+        for uf, fim, quantidade in zip(UFS, limites, np.diff(limites, prepend=0)) if quantidade
+    }
+
+# Grava uma edição ordenada por UF: as colunas, o cubo de agregados, as estatísticas por região, os
+# histogramas de notas e o manifesto (completado com o esquema e o intervalo de linhas de cada UF).
+# A edição é montada num diretório temporário e só então substitui a anterior
+def gravar_edicao(ano, df, cubo, histogramas, manifesto):
+    destino = diretorio_edicao(ano)
+    os.makedirs(DIRETORIO_PARTICOES, exist_ok=True)
+    temporario = tempfile.mkdtemp(prefix=f'ano={ano}.tmp', dir=DIRETORIO_PARTICOES)
+    try:
+        os.chmod(temporario, 0o755)
+        manifesto['esquema'] = gravar_colunas(df, os.path.join(temporario, 'colunas'))
+        manifesto['particoes'] = limites_particoes(df)
+        cubo.to_parquet(os.path.join(temporario, 'cubo.parquet'), index=False)
+        for nivel in NIVEIS_REGIAO:
+            construir_regioes(cubo, nivel).to_parquet(
+                os.path.join(temporario, f'regioes_{nivel}.parquet'), index=False
+            )
+        combinacoes, *csr = histogramas
+        manifesto['esquema_histogramas'] = gravar_colunas(combinacoes, os.path.join(temporario, 'histogramas'))
+        for nome, valores in zip(ARQUIVOS_HISTOGRAMAS, csr):
+            np.save(os.path.join(temporario, 'histogramas', f'{nome}.npy'), valores)
+        with open(os.path.join(temporario, 'manifesto.json'), 'w', encoding='utf-8') as arquivo:
+            json.dump(manifesto, arquivo, ensure_ascii=False)
+        shutil.rmtree(destino, ignore_errors=True)
+        os.replace(temporario, destino)
+    except BaseException:
+        shutil.rmtree(temporario, ignore_errors=True)
+        raise
+    return manifesto
+
+# Etapa de ETL: trata o CSV de uma edição e os lotes já anexados a ela, ordena as linhas por UF e
+# grava a edição com a impressão digital do CSV e os centróides. A versão continua a contagem da
+# edição anterior (nunca se repete no mesmo diretório) e passa a valer para todas as UFs
+def particionar_edicao(ano, limite_linhas=None):
+    with travar_edicao(ano):
+        return particionar_edicao_travada(ano, limite_linhas)
+
+def particionar_edicao_travada(ano, limite_linhas=None):
+    caminho_csv = fontes_csv()[ano]
+    incrementos = arquivos_incrementos(ano)
+    df = preparar_dados(caminho_csv, limite_linhas, incrementos=incrementos)
+    df = df.sort_values('SG_UF_ESC', kind='stable', ignore_index=True)
+
+    anterior = ler_manifesto(ano)
+    versao = anterior.get('versao', 0) + 1 if anterior is not None else 1
+    manifesto = {
+        'ano': ano,
+        'impressao': impressao_digital(caminho_csv, limite_linhas),
+        'centroides': df.attrs['centroides'],
+        'versao': versao,
+        'versoes_uf': {uf: versao for uf in UFS},
+        'incrementos': [os.path.basename(incremento) for incremento in incrementos]
+    }
+    return gravar_edicao(ano, df, construir_cubo(df), construir_histogramas(df), manifesto)
+
+# Mesmas colunas categóricas com as mesmas categorias (as de tabela fixa já coincidem; os municípios
+# são unidos em ordem alfabética, como em concatenar_blocos), para concatenar sem perder o tipo
+def unificar_categorias(tabelas, colunas):
+    tabelas = [tabela.copy(deep=False) for tabela in tabelas]
+    for coluna in colunas:
+        tipos = [tabela[coluna].dtype for tabela in tabelas]
+        if all(tipo == tipos[0] for tipo in tipos):
+            continue
+        categorias = sorted(set().union(*(tipo.categories for tipo in tipos)))
+        tipo = pd.CategoricalDtype(categorias, ordered=tipos[0].ordered)
+        for tabela in tabelas:
+            tabela[coluna] = tabela[coluna].astype(tipo)
+    return tabelas
+
+# Soma agregados aditivos (cubos) pelas chaves, mantendo os tipos das colunas somadas
+def somar_agregados(tabelas, chaves):
+    categoricas = [chave for chave in chaves if isinstance(tabelas[0][chave].dtype, pd.CategoricalDtype)]
+    juntas = pd.concat(unificar_categorias(tabelas, categoricas), ignore_index=True)
+    somas = [coluna for coluna in juntas.columns if coluna not in chaves]
+    soma = juntas.groupby(chaves, observed=True)[somas].sum().reset_index()
+    return soma.astype({coluna: tabelas[0][coluna].dtype for coluna in somas})
+
+# Ingestão incremental: anexa a uma edição já particionada as linhas de um CSV no formato do INEP,
+# sem tratar de novo o CSV da edição. As linhas novas passam pela mesma limpeza e recebem clusters
+# pelos centróides gravados (sem reajuste); o cubo e os histogramas recebem só a soma dos agregados
+# das linhas novas. As colunas, porém, são regravadas por inteiro: a edição mapeada é concatenada às
+# linhas novas e reordenada por UF, então a edição toda passa pela memória durante a gravação.
+# O CSV é guardado em dados/incrementos para que reparticionamentos o incluam, e só as UFs que
+# receberam linhas mudam de versão. Um mesmo arquivo (pelo conteúdo) não é anexado duas vezes
+def anexar_incremento(ano, caminho, limite_linhas=None):
+    with travar_edicao(ano):
+        return anexar_incremento_travado(ano, caminho, limite_linhas)
+
+def anexar_incremento_travado(ano, caminho, limite_linhas=None):
+    manifesto = copy.deepcopy(atualizar_edicao(ano, limite_linhas))
+    with open(caminho, 'rb') as arquivo:
+        resumo = hashlib.file_digest(arquivo, 'sha1').hexdigest()
+    if any(nome.endswith(f'_{resumo}.csv') for nome in manifesto['incrementos']):
+        raise ValueError(f'{caminho} já foi anexado à edição {ano}')
+
+    novo = preparar_dados(caminho, centroides=manifesto['centroides'])
+    if novo.empty:
+        return manifesto
+    antigo = mapear_edicao(ano, versao_edicao(ano, limite_linhas))
+    categoricas = [coluna for coluna, esquema in manifesto['esquema'].items() if esquema is not None]
+    df = pd.concat(unificar_categorias([antigo, novo], categoricas), ignore_index=True)
+    # Ordenação estável: dentro de cada UF, as linhas novas ficam depois das existentes
+    df = df.sort_values('SG_UF_ESC', kind='stable', ignore_index=True)
+
+    diretorio = diretorio_edicao(ano)
+    cubo = somar_agregados(
+        [pd.read_parquet(os.path.join(diretorio, 'cubo.parquet')), construir_cubo(novo)], DIMENSOES_CUBO
+    )
+    histogramas = somar_histogramas([ler_histogramas(ano, manifesto), construir_histogramas(novo)])
+
+    nome = f"{len(manifesto['incrementos']) + 1:04d}_{resumo}.csv"
+    os.makedirs(diretorio_incrementos(ano), exist_ok=True)
+    shutil.copyfile(caminho, os.path.join(diretorio_incrementos(ano), nome))
+    manifesto['versao'] += 1
+    for uf in novo['SG_UF_ESC'].unique():
+        manifesto['versoes_uf'][uf] = manifesto['versao']
+    manifesto['incrementos'].append(nome)
+    return gravar_edicao(ano, df, cubo, histogramas, manifesto)
+
+# Trava de escrita de uma edição: entre as threads do processo (uma trava para todas as edições) e
+# entre processos (flock num arquivo ao lado do diretório da edição, que é substituído ao gravar)
+_trava_edicoes = threading.Lock()
+
+@contextlib.contextmanager
+def travar_edicao(ano):
+    os.makedirs(DIRETORIO_PARTICOES, exist_ok=True)
+    with _trava_edicoes, open(os.path.join(DIRETORIO_PARTICOES, f'ano={ano}.lock'), 'w') as trava:
+        fcntl.flock(trava, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(trava, fcntl.LOCK_UN)
+
+# Manifesto atual da edição, ou None se não existe ou não corresponde ao CSV atual
+def manifesto_atual(ano, limite_linhas=None):
+    manifesto = ler_manifesto(ano)
+    fonte = fontes_csv().get(ano)
+    if manifesto is None or (fonte is not None and manifesto['impressao'] != impressao_digital(fonte, limite_linhas)):
+        return None
+    return manifesto
+
+# Com a trava da edição: refaz as partições se não correspondem ao CSV atual
+def atualizar_edicao(ano, limite_linhas=None):
+    manifesto = manifesto_atual(ano, limite_linhas)
+    if manifesto is not None:
+        return manifesto
+    if ano not in fontes_csv():
+        raise FileNotFoundError(f'Edição {ano} do ENEM não encontrada em {DIRETORIO_DADOS}')
+    return particionar_edicao_travada(ano, limite_linhas)
+
+# Manifesto de uma edição com partições atualizadas: refaz as partições quando não correspondem
+# ao CSV atual (sem CSV, confia nas partições existentes). Só o reparticionamento toma a trava, e o
+# manifesto é relido dentro dela: quem esperava encontra a edição já refeita por outra thread ou processo
+def garantir_edicao(ano, limite_linhas=None):
+    manifesto = manifesto_atual(ano, limite_linhas)
+    if manifesto is not None:
+        return manifesto
+    with travar_edicao(ano):
+        return atualizar_edicao(ano, limite_linhas)
+
+# DataFrame sobre colunas gravadas por gravar_colunas, mapeadas em memória somente leitura
+def ler_colunas(diretorio, esquemas):
+    colunas = {}
+    for coluna, esquema in esquemas.items():
+        valores = np.load(os.path.join(diretorio, f'{coluna}.npy'), mmap_mode='r')
+        if esquema is not None:
+            tipo = pd.CategoricalDtype(esquema['categorias'], ordered=esquema['ordenada'])
+            valores = pd.Categorical.from_codes(valores, dtype=tipo, validate=False)
+        colunas[coluna] = valores
+    return pd.DataFrame(colunas, copy=False)
+
+# A edição mudou de versão enquanto era lida: quem chamou resolve a versão de novo
+class VersaoSuperada(Exception):
+    pass
+
+# Versão de uma edição segundo o seu manifesto (a de versao_edicao sem estado)
+def versao_manifesto(ano, manifesto):
+    return None if manifesto is None else f"{ano}:{manifesto['impressao']}:{manifesto['versao']}"
+
+# Lê arquivos da edição na versão pedida (ler recebe o manifesto). O manifesto é conferido antes e
+# depois da leitura: a edição é substituída de uma vez e as versões não se repetem, então o que foi
+# lido é todo da versão pedida. Assim um carregador chaveado por versão nunca guarda outra versão
+def ler_versao(ano, versao, ler):
+    if versao_manifesto(ano, ler_manifesto(ano)) != versao:
+        raise VersaoSuperada(f'A edição {ano} não está mais na versão {versao}')
+    resultado = ler(ler_manifesto(ano))
+    if versao_manifesto(ano, ler_manifesto(ano)) != versao:
+        raise VersaoSuperada(f'A edição {ano} mudou durante a leitura da versão {versao}')
+    return resultado
+
+# Resultado de um carregador chaveado por versão, na versão atual da edição (resolvida de novo se
+# a edição mudar durante a leitura)
+def na_versao_atual(ano, limite_linhas, carregar):
+    while True:
+        try:
+            return carregar(versao_edicao(ano, limite_linhas))
+        except VersaoSuperada:
+            continue
+
+# DataFrame somente leitura sobre as colunas mapeadas em memória (nenhuma coluna é copiada), com os
+# centróides e o intervalo de linhas de cada UF da mesma versão. A versão faz parte da chave, então
+# edições refeitas ou ampliadas nunca reaproveitam o mapeamento antigo
+@functools.lru_cache(maxsize=MAX_EDICOES_MAPEADAS)
+def mapear_edicao(ano, versao):
+    def ler(manifesto):
+        df = ler_colunas(os.path.join(diretorio_edicao(ano), 'colunas'), manifesto['esquema'])
+        df.attrs['centroides'] = manifesto['centroides']
+        df.attrs['particoes'] = manifesto['particoes']
+        return df
+    return ler_versao(ano, versao, ler)
+
+# Centróides persistidos no manifesto, para rotular dados novos sem reajustar o modelo
+def ler_centroides(ano=ANO_PADRAO):
+    manifesto = ler_manifesto(ano)
+    return None if manifesto is None else np.array(manifesto['centroides'])
+
+# Dados de uma edição, compartilhados entre sessões (st.cache_resource) e somente leitura.
+# Uma UF é uma fatia do mapeamento, então só as páginas dela são lidas do disco (ufs=None: todas).
+# Como os demais carregadores, a entrada em cache é chaveada pela versão da edição
+def carregar_dados(ano=ANO_PADRAO, ufs=None, limite_linhas=None):
+    return na_versao_atual(ano, limite_linhas, lambda versao: dados_versao(ano, ufs, versao))
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def dados_versao(ano, ufs, versao):
+    df = mapear_edicao(ano, versao)
+    if ufs is None:
+        return df
+    particoes = df.attrs['particoes']
+    fatias = [slice(*particoes[uf]) for uf in ufs if uf in particoes]
+    if not fatias:
+        return df.iloc[:0]
+    if len(fatias) == 1:
+        return df.iloc[fatias[0]]
+    return pd.concat([df.iloc[fatia] for fatia in fatias])
+
+# Limpeza de um bloco do CSV: descarta ausentes e 'Não Respondeu', decodifica e calcula a média
+def tratar_bloco(bloco):
+    bloco = bloco.dropna()
+    bloco = bloco[bloco['TP_ESCOLA'] != ESCOLA_NAO_RESPONDEU]
+
+    for coluna in DECODIFICACAO:
+        bloco[coluna] = decodificar(bloco[coluna])
+
+    # Média em float64 para que a clusterização não dependa da precisão reduzida das notas
+    bloco['MEDIA_NOTAS'] = bloco[NOTAS].astype('float64').mean(axis=1)
+    return bloco
+
+# Junta os blocos do CSV unificando as categorias de município, que não têm tabela fixa
+def concatenar_blocos(blocos):
+    posicao = blocos[0].columns.get_loc('NO_MUNICIPIO_ESC')
+    df = pd.concat([bloco.drop(columns='NO_MUNICIPIO_ESC') for bloco in blocos], ignore_index=True)
+    municipios = union_categoricals([bloco['NO_MUNICIPIO_ESC'] for bloco in blocos], sort_categories=True)
+    df.insert(posicao, 'NO_MUNICIPIO_ESC', municipios.remove_unused_categories())
+    return df
+
+# K-Means 1-D ajustado sobre o histograma da média: cada valor distinto entra uma vez, com peso
+# igual à sua frequência. Com início determinístico (quantis ponderados) e iteração até convergir,
+# o resultado é o mesmo do ajuste sobre todas as linhas. Centróides em ordem crescente (cluster 0 = menor média)
+def ajustar_centroides(valores, n_clusters=N_CLUSTERS):
+    # Importado aqui: o scikit-learn leva cerca de 1 s para carregar e só o ETL precisa dele
+    from sklearn.cluster import KMeans
+
+    passos = np.round(np.asarray(valores, dtype='float64') / RESOLUCAO_CLUSTER).astype('int64')
+    menor = passos.min()
+    frequencias = np.bincount(passos - menor)
+    ocupados = np.flatnonzero(frequencias)
+    pontos = (ocupados + menor) * RESOLUCAO_CLUSTER
+    pesos = frequencias[ocupados]
+
+    acumulado = np.cumsum(pesos) / pesos.sum()
+    inicio = np.interp((np.arange(n_clusters) + 0.5) / n_clusters, acumulado, pontos)
+    kmeans = KMeans(n_clusters=n_clusters, init=inicio.reshape(-1, 1), n_init=1, tol=0)
+    kmeans.fit(pontos.reshape(-1, 1), sample_weight=pesos)
+    return np.sort(kmeans.cluster_centers_.ravel())
+
+# Rótulo do centróide mais próximo por busca binária nos pontos médios entre centróides vizinhos
+def atribuir_clusters(valores, centroides):
+    centroides = np.asarray(centroides)
+    pontos_medios = (centroides[1:] + centroides[:-1]) / 2
+    return np.searchsorted(pontos_medios, valores).astype('int8')
+
+# Blocos tratados de um CSV, lidos apenas com as colunas usadas
+def ler_blocos(caminho, limite_linhas=None, tamanho_bloco=TAMANHO_BLOCO):
+    leitor = pd.read_csv(
+        caminho, sep=';', encoding='latin1', usecols=COLUNAS, dtype=TIPOS_CSV,
+        nrows=limite_linhas, chunksize=tamanho_bloco
+    )
+    return [tratar_bloco(bloco) for bloco in leitor]
+
+# Etapa de ETL: lê o CSV (seguido dos CSVs de incrementos, sem limite de linhas) em blocos e devolve
+# o DataFrame limpo e tipado. Com centróides informados, os clusters são atribuídos sem novo ajuste
+def preparar_dados(caminho=CAMINHO_CSV, limite_linhas=None, tamanho_bloco=TAMANHO_BLOCO, centroides=None,
+                   incrementos=()):
+    blocos = ler_blocos(caminho, limite_linhas, tamanho_bloco)
+    for incremento in incrementos:
+        blocos += ler_blocos(incremento, tamanho_bloco=tamanho_bloco)
+    df = concatenar_blocos(blocos)
+
+    # Clusterização da média das notas
+    medias = df['MEDIA_NOTAS'].to_numpy()
+    if centroides is None:
+        centroides = ajustar_centroides(medias)
+    df['CLUSTER'] = atribuir_clusters(medias, centroides)
+    df['MEDIA_NOTAS'] = df['MEDIA_NOTAS'].astype('float32')
+
+    df = df[COLUNAS + ['MEDIA_NOTAS', 'CLUSTER']]
+    df.attrs['centroides'] = [float(centroide) for centroide in centroides]
+    return df
+
+# Cubo de agregados: uma linha por combinação observada das dimensões de filtro e gráficos,
+# com quantidade, soma e soma dos quadrados de cada nota
+DIMENSOES_CUBO = ['TP_SEXO', 'TP_ESCOLA', 'SG_UF_ESC', 'NO_MUNICIPIO_ESC', 'TP_FAIXA_ETARIA', 'TP_DEPENDENCIA_ADM_ESC']
+MEDIDAS = NOTAS + ['MEDIA_NOTAS']
+COLUNAS_FILTRO = ['TP_SEXO', 'TP_ESCOLA', 'SG_UF_ESC', 'NO_MUNICIPIO_ESC']
+
+def construir_cubo(df):
+    grupos = df.groupby(DIMENSOES_CUBO, observed=True)
+    quantidades = grupos.size()
+    ids = grupos.ngroup().to_numpy()
+
+    cubo = quantidades.index.to_frame(index=False)
+    cubo['QUANTIDADE'] = quantidades.to_numpy()
+    for medida in MEDIDAS:
+        valores = df[medida].to_numpy(dtype='float64')
+        cubo[f'SOMA_{medida}'] = np.bincount(ids, weights=valores, minlength=len(cubo))
+        cubo[f'SOMA_QUADRADOS_{medida}'] = np.bincount(ids, weights=valores * valores, minlength=len(cubo))
+    return cubo
+
+# Cubo de uma edição, gravado junto com as colunas: não lê as linhas
+def carregar_cubo(ano=ANO_PADRAO, limite_linhas=None):
+    return na_versao_atual(ano, limite_linhas, lambda versao: cubo_versao(ano, versao))
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cubo_versao(ano, versao):
+    return ler_versao(ano, versao, lambda _: pd.read_parquet(os.path.join(diretorio_edicao(ano), 'cubo.parquet')))
+
+# Recorte do cubo segundo os filtros da barra lateral ('Todos' não restringe)
+def fatiar_cubo(cubo, sexo='Todos', escola='Todos', estado='Todos', municipio='Todos'):
+    mascara = np.ones(len(cubo), dtype=bool)
+    for coluna, valor in zip(COLUNAS_FILTRO, (sexo, escola, estado, municipio)):
+        if valor != 'Todos':
+            mascara &= (cubo[coluna] == valor).to_numpy()
+    return cubo[mascara]
+
+# Contagens da pirâmide etária num único bincount sobre os códigos de faixa etária, sexo e das
+# dimensões extras (ex.: tipo de escola). Aceita linhas ou células do cubo (pesadas por QUANTIDADE)
+# e devolve apenas as combinações não vazias
+def contar_piramide(dados, extras=()):
+    colunas = ['TP_FAIXA_ETARIA', 'TP_SEXO'] + list(extras)
+    formato = tuple(len(dados[coluna].cat.categories) for coluna in colunas)
+    chave = np.ravel_multi_index(
+        [dados[coluna].cat.codes.to_numpy().astype('int64') for coluna in colunas], formato
+    )
+    pesos = dados['QUANTIDADE'].to_numpy() if 'QUANTIDADE' in dados.columns else None
+    contagem = np.bincount(chave, weights=pesos, minlength=int(np.prod(formato)))
+    ocupadas = np.flatnonzero(contagem)
+    piramide = pd.DataFrame({
+        coluna: pd.Categorical.from_codes(codigos, dtype=dados[coluna].dtype)
+        for coluna, codigos in zip(colunas, np.unravel_index(ocupadas, formato))
     })
+    piramide['Quantidade'] = contagem[ocupadas].astype('int64')
+    return piramide
+
+# Opções da barra lateral: UFs presentes e, por UF (e para 'Todos'), os municípios em ordem alfabética
+def construir_opcoes_regiao(cubo):
+    pares = cubo[['SG_UF_ESC', 'NO_MUNICIPIO_ESC']].drop_duplicates()
+    municipios_por_uf = {
+        uf: sorted(grupo['NO_MUNICIPIO_ESC'].unique())
+        for uf, grupo in pares.groupby('SG_UF_ESC', observed=True)
+    }
+    municipios_por_uf['Todos'] = sorted(pares['NO_MUNICIPIO_ESC'].unique())
+    ufs = sorted(uf for uf in municipios_por_uf if uf != 'Todos')
+    return ufs, municipios_por_uf
+
+def carregar_opcoes_regiao(ano=ANO_PADRAO, limite_linhas=None):
+    return na_versao_atual(ano, limite_linhas, lambda versao: opcoes_regiao_versao(ano, versao))
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def opcoes_regiao_versao(ano, versao):
+    return construir_opcoes_regiao(cubo_versao(ano, versao))
+
+# Estatísticas por região (UF ou município): quantidade, média geral e médias e quantidades das
+# escolas públicas e privadas, com a diferença entre elas. Calculadas do cubo ao particionar a edição
+# e gravadas com ela, para o ranking não agrupar linhas a cada execução
+NIVEIS_REGIAO = {'uf': ['SG_UF_ESC'], 'municipio': ['SG_UF_ESC', 'NO_MUNICIPIO_ESC']}
+
+def construir_regioes(cubo, nivel):
+    chaves = NIVEIS_REGIAO[nivel]
+    somas = ['QUANTIDADE', 'SOMA_MEDIA_NOTAS']
+    regioes = cubo.groupby(chaves, observed=True)[somas].sum()
+    for escola, sufixo in (('Pública', 'PUBLICA'), ('Privada', 'PRIVADA')):
+        parte = cubo[cubo['TP_ESCOLA'] == escola].groupby(chaves, observed=True)[somas].sum()
+        parte = parte.reindex(regioes.index, fill_value=0)
+        regioes[f'QUANTIDADE_{sufixo}'] = parte['QUANTIDADE']
+        regioes[f'MEDIA_{sufixo}'] = parte['SOMA_MEDIA_NOTAS'] / parte['QUANTIDADE'].where(parte['QUANTIDADE'] > 0)
+    regioes['MEDIA_NOTAS'] = regioes.pop('SOMA_MEDIA_NOTAS') / regioes['QUANTIDADE']
+    regioes['DIFERENCA_ESCOLAS'] = regioes['MEDIA_PRIVADA'] - regioes['MEDIA_PUBLICA']
+    return regioes.reset_index()
+
+def carregar_regioes(ano=ANO_PADRAO, nivel='uf', limite_linhas=None):
+    return na_versao_atual(ano, limite_linhas, lambda versao: regioes_versao(ano, nivel, versao))
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def regioes_versao(ano, nivel, versao):
+    return ler_versao(
+        ano, versao, lambda _: pd.read_parquet(os.path.join(diretorio_edicao(ano), f'regioes_{nivel}.parquet'))
+    )
+
+# Índice de percentis: histograma de cada nota em faixas fixas de LARGURA_FAIXA_NOTA pontos, por
+# combinação dos filtros da barra lateral. As combinações observadas ficam ordenadas (colunas .npy em
+# histogramas/, como as da edição) e os histogramas em formato esparso (CSR), mapeados em memória:
+# a linha (combinação, medida) ocupa as entradas inicios[linha]:inicios[linha + 1] de faixas e
+# contagens, só com as faixas não vazias. Percentis, CDF e quantis de qualquer recorte saem da soma
+# das linhas das combinações filtradas, localizadas pelo índice invertido das combinações
+LARGURA_FAIXA_NOTA = 1.0
+N_FAIXAS_NOTA = int(1000 / LARGURA_FAIXA_NOTA) + 1
+ARQUIVOS_HISTOGRAMAS = ('inicios', 'faixas', 'contagens')
+
+# Arrays CSR de n_linhas linhas a partir das chaves ordenadas (linha * N_FAIXAS_NOTA + faixa)
+def montar_csr(n_linhas, chaves, quantidades):
+    inicios = np.zeros(n_linhas + 1, dtype='int64')
+    inicios[1:] = np.cumsum(np.bincount(chaves // N_FAIXAS_NOTA, minlength=n_linhas))
+    return inicios, (chaves % N_FAIXAS_NOTA).astype('int16'), quantidades.astype('int32')
+
+# Chave (linha * N_FAIXAS_NOTA + faixa) de cada entrada, com a combinação renumerada por `ids`
+def chaves_csr(inicios, faixas, ids):
+    linhas = np.repeat(np.arange(len(inicios) - 1, dtype='int64'), np.diff(inicios))
+    linhas = ids[linhas // len(MEDIDAS)] * len(MEDIDAS) + linhas % len(MEDIDAS)
+    return linhas * N_FAIXAS_NOTA + faixas
+
+# (combinações, inicios, faixas, contagens) de um DataFrame tratado. Cada medida é contada à parte
+# (np.unique sobre uma chave int64 por linha) e só as entradas não vazias são juntadas e ordenadas
+def construir_histogramas(df):
+    grupos = df.groupby(COLUNAS_FILTRO, observed=True)
+    combinacoes = grupos.size().index.to_frame(index=False)
+    ids = grupos.ngroup().to_numpy().astype('int64')
+    todas_chaves, todas_quantidades = [], []
+    for posicao, medida in enumerate(MEDIDAS):
+        faixas = np.clip(df[medida].to_numpy() // LARGURA_FAIXA_NOTA, 0, N_FAIXAS_NOTA - 1).astype('int64')
+        chaves, quantidades = np.unique(ids * N_FAIXAS_NOTA + faixas, return_counts=True)
+        linhas = chaves // N_FAIXAS_NOTA * len(MEDIDAS) + posicao
+        todas_chaves.append(linhas * N_FAIXAS_NOTA + chaves % N_FAIXAS_NOTA)
+        todas_quantidades.append(quantidades)
+    chaves = np.concatenate(todas_chaves)
+    ordem = np.argsort(chaves, kind='stable')
+    return (combinacoes, *montar_csr(
+        len(combinacoes) * len(MEDIDAS), chaves[ordem], np.concatenate(todas_quantidades)[ordem]
+    ))
+
+# Soma histogramas de várias origens na união ordenada das suas combinações
+def somar_histogramas(partes):
+    combinacoes = pd.concat(
+        unificar_categorias([parte[0] for parte in partes], COLUNAS_FILTRO), ignore_index=True
+    )
+    grupos = combinacoes.groupby(COLUNAS_FILTRO, observed=True)
+    ids = grupos.ngroup().to_numpy().astype('int64')
+    todas_chaves, inicio = [], 0
+    for parte_combinacoes, inicios, faixas, _ in partes:
+        todas_chaves.append(chaves_csr(inicios, faixas, ids[inicio:inicio + len(parte_combinacoes)]))
+        inicio += len(parte_combinacoes)
+    chaves, inversa = np.unique(np.concatenate(todas_chaves), return_inverse=True)
+    quantidades = np.bincount(inversa, weights=np.concatenate([parte[3] for parte in partes]))
+    return (grupos.size().index.to_frame(index=False), *montar_csr(
+        grupos.ngroups * len(MEDIDAS), chaves, quantidades
+    ))
+
+# (combinações, inicios, faixas, contagens) gravados numa edição, mapeados em memória
+def ler_histogramas(ano, manifesto):
+    diretorio = os.path.join(diretorio_edicao(ano), 'histogramas')
+    return (
+        ler_colunas(diretorio, manifesto['esquema_histogramas']),
+        *(np.load(os.path.join(diretorio, f'{nome}.npy'), mmap_mode='r') for nome in ARQUIVOS_HISTOGRAMAS)
+    )
+
+# Histogramas de uma edição, compartilhados (somente leitura) entre as sessões: o índice invertido
+# das combinações e os arrays CSR
+def carregar_histogramas(ano=ANO_PADRAO, limite_linhas=None):
+    return na_versao_atual(ano, limite_linhas, lambda versao: histogramas_versao(ano, versao))
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def histogramas_versao(ano, versao):
+    combinacoes, *csr = ler_versao(ano, versao, lambda manifesto: ler_histogramas(ano, manifesto))
+    return construir_indice(combinacoes), *csr
+
+# Contagens por faixa de uma nota no recorte, somando as linhas CSR das combinações filtradas
+def histograma_recorte(histogramas, medida, sexo='Todos', escola='Todos', estado='Todos', municipio='Todos'):
+    indice, inicios, faixas, contagens = histogramas
+    posicoes = selecionar_linhas(indice, sexo, escola, estado, municipio)
+    if posicoes is None:
+        posicoes = np.arange((len(inicios) - 1) // len(MEDIDAS))
+    linhas = posicoes.astype('int64') * len(MEDIDAS) + MEDIDAS.index(medida)
+    comecos, tamanhos = inicios[linhas], inicios[linhas + 1] - inicios[linhas]
+    # Posições das entradas de todas as linhas selecionadas, em sequência
+    entradas = np.arange(tamanhos.sum()) + np.repeat(comecos - np.cumsum(tamanhos) + tamanhos, tamanhos)
+    return np.bincount(
+        faixas[entradas], weights=contagens[entradas], minlength=N_FAIXAS_NOTA
+    ).astype('int64')
+
+# Percentual de notas menores ou iguais a `nota` (CDF), interpolando dentro da faixa da nota
+def percentil_nota(contagens, nota):
+    total = contagens.sum()
+    if total == 0:
+        return np.nan
+    faixa = int(np.clip(nota // LARGURA_FAIXA_NOTA, 0, N_FAIXAS_NOTA - 1))
+    fracao = np.clip((nota - faixa * LARGURA_FAIXA_NOTA) / LARGURA_FAIXA_NOTA, 0, 1)
+    return 100 * (contagens[:faixa].sum() + fracao * contagens[faixa]) / total
 
-    ordem_faixas = [
-        'Menor de 17 anos', '17 anos', '18 anos', '19 anos', '20 anos', '21 anos', '22 anos', '23 anos', '24 anos',
-        '25 anos', 'Entre 26 e 30 anos', 'Entre 31 e 35 anos', 'Entre 36 e 40 anos', 'Entre 41 e 45 anos',
-        'Entre 46 e 50 anos', 'Entre 51 e 55 anos', 'Entre 56 e 60 anos', 'Entre 61 e 65 anos',
-        'Entre 66 e 70 anos', 'Maior de 70 anos'
+# Nota correspondente a cada quantil (0 a 1), pela inversa da CDF interpolada nas faixas
+def quantis_nota(contagens, quantis):
+    total = contagens.sum()
+    if total == 0:
+        return np.full(len(quantis), np.nan)
+    acumulado = np.concatenate([[0], np.cumsum(contagens)]) / total
+    limites = np.arange(N_FAIXAS_NOTA + 1) * LARGURA_FAIXA_NOTA
+    # Repetições em acumulado (faixas vazias) não afetam a interpolação: np.interp usa o primeiro ponto
+    return np.interp(quantis, acumulado, limites)
+
+# Percentil de uma nota e quantis de referência de uma disciplina no recorte da barra lateral
+def consultar_percentil(ano, medida, nota, sexo='Todos', escola='Todos', estado='Todos', municipio='Todos',
+                        limite_linhas=None, quantis=(0.1, 0.25, 0.5, 0.75, 0.9)):
+    contagens = histograma_recorte(carregar_histogramas(ano, limite_linhas), medida, sexo, escola, estado, municipio)
+    return {
+        'quantidade': int(contagens.sum()),
+        'percentil': percentil_nota(contagens, nota),
+        'quantis': dict(zip(quantis, quantis_nota(contagens, quantis)))
+    }
+
+# Índice invertido dos filtros: para cada coluna, as posições das linhas agrupadas por código
+# (ordem) e o início do grupo de cada código (limites); dentro de um grupo as posições são crescentes
+def construir_indice(df):
+    indice = {}
+    for coluna in COLUNAS_FILTRO:
+        codigos = df[coluna].cat.codes.to_numpy()
+        categorias = df[coluna].cat.categories
+        ordem = np.argsort(codigos, kind='stable').astype('int32')
+        limites = np.zeros(len(categorias) + 1, dtype='int64')
+        limites[1:] = np.cumsum(np.bincount(codigos, minlength=len(categorias)))
+        indice[coluna] = (categorias, ordem, limites)
+    return indice
+
+def carregar_indice(ano=ANO_PADRAO, ufs=None, limite_linhas=None):
+    return na_versao_atual(ano, limite_linhas, lambda versao: indice_versao(ano, ufs, versao))
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def indice_versao(ano, ufs, versao):
+    return construir_indice(dados_versao(ano, ufs, versao))
+
+# Posições das linhas com o valor na coluna (fatia do índice, sem cópia)
+def posicoes_valor(indice, coluna, valor):
+    categorias, ordem, limites = indice[coluna]
+    if valor not in categorias:
+        return ordem[:0]
+    codigo = categorias.get_loc(valor)
+    return ordem[limites[codigo]:limites[codigo + 1]]
+
+# Interseção de listas ordenadas de posições, partindo da menor e usando busca binária nas demais
+def intersectar_posicoes(listas):
+    listas = sorted(listas, key=len)
+    resultado = listas[0]
+    for outra in listas[1:]:
+        if len(resultado) == 0 or len(outra) == 0:
+            return resultado[:0]
+        encontradas = np.minimum(np.searchsorted(outra, resultado), len(outra) - 1)
+        resultado = resultado[outra[encontradas] == resultado]
+    return resultado
+
+# Posições das linhas que atendem aos filtros da barra lateral (None quando nada é filtrado)
+def selecionar_linhas(indice, sexo='Todos', escola='Todos', estado='Todos', municipio='Todos'):
+    listas = [
+        posicoes_valor(indice, coluna, valor)
+        for coluna, valor in zip(COLUNAS_FILTRO, (sexo, escola, estado, municipio)) if valor != 'Todos'
     ]
-    df['TP_FAIXA_ETARIA'] = pd.Categorical(df['TP_FAIXA_ETARIA'], categories=ordem_faixas, ordered=True)
+    if not listas:
+        return None
+    return intersectar_posicoes(listas)
 
-    # Ajustes de texto
-    df['TP_SEXO'] = df['TP_SEXO'].replace({'M': 'Masculino', 'F': 'Feminino'})
-    df['TP_DEPENDENCIA_ADM_ESC'] = df['TP_DEPENDENCIA_ADM_ESC'].astype(str).replace({
-        '1.0': 'Federal', '2.0': 'Estadual', '3.0': 'Municipal', '4.0': 'Privada'
-    })
-    df['TP_ESCOLA'] = df['TP_ESCOLA'].astype(str).replace({
-        '1': 'Não Respondeu', '2': 'Pública', '3': 'Privada'
-    }).str.strip()
-    df = df[df['TP_ESCOLA'] != 'Não Respondeu']
+# Apenas as colunas pedidas das linhas selecionadas, sem copiar o restante do DataFrame
+def linhas_selecionadas(df, posicoes, colunas):
+    if posicoes is None:
+        return df[colunas]
+    return pd.DataFrame({coluna: df[coluna].array.take(posicoes) for coluna in colunas})
 
-    # Média das notas
-    df['MEDIA_NOTAS'] = df[
-        ['NU_NOTA_MT', 'NU_NOTA_CN', 'NU_NOTA_CH', 'NU_NOTA_LC', 'NU_NOTA_REDACAO']
-    ].mean(axis=1)
+# Distribuição de uma nota por grupo para o violino, calculada no servidor: histograma fino,
+# KDE gaussiana por convolução do histograma (banda de Silverman), quartis, média e uma amostra
+# limitada de pontos. O gráfico recebe só esses resumos, nunca a coluna inteira
+BINS_DISTRIBUICAO = 1000
+PONTOS_CURVA = 200
 
-    # Clusterização com K-Means
-    kmeans = KMeans(n_clusters=3, random_state=42)
-    df['CLUSTER'] = kmeans.fit_predict(df[['MEDIA_NOTAS']])
+def preparar_distribuicao(df, posicoes, grupo='TP_ESCOLA', valor='MEDIA_NOTAS', amostra=1000, semente=42):
+    dados = linhas_selecionadas(df, posicoes, [grupo, valor])
+    categorias = dados[grupo].cat.categories
+    codigos = dados[grupo].cat.codes.to_numpy().astype('int64')
+    valores = dados[valor].to_numpy(dtype='float64')
+    if len(valores) == 0:
+        return []
 
-    return df
+    minimo, maximo = valores.min(), valores.max()
+    largura = (maximo - minimo) / BINS_DISTRIBUICAO or 1.0
+    bins = np.minimum(((valores - minimo) / largura).astype('int64'), BINS_DISTRIBUICAO - 1)
+    histogramas = np.bincount(
+        codigos * BINS_DISTRIBUICAO + bins, minlength=len(categorias) * BINS_DISTRIBUICAO
+    ).reshape(len(categorias), BINS_DISTRIBUICAO)
+    quantidades = histogramas.sum(axis=1)
+    somas = np.bincount(codigos, weights=valores, minlength=len(categorias))
+    somas_quadrados = np.bincount(codigos, weights=valores * valores, minlength=len(categorias))
+    bordas = minimo + largura * np.arange(BINS_DISTRIBUICAO + 1)
+
+    gerador = np.random.default_rng(semente)
+    distribuicao = []
+    for codigo, rotulo in enumerate(categorias):
+        n = quantidades[codigo]
+        if n == 0:
+            continue
+        media = somas[codigo] / n
+        desvio = np.sqrt(max(somas_quadrados[codigo] / n - media * media, 0.0))
+        acumulado = np.concatenate([[0.0], np.cumsum(histogramas[codigo]) / n])
+        q1, mediana, q3 = np.interp([0.25, 0.5, 0.75], acumulado, bordas)
+
+        # KDE: convolução do histograma com o núcleo gaussiano amostrado na largura do bin
+        banda = 1.059 * min(desvio, (q3 - q1) / 1.349 or desvio) * n ** -0.2
+        banda_bins = max(banda / largura, 1.0)
+        raio = int(np.ceil(3 * banda_bins))
+        deslocamentos = np.arange(-raio, raio + 1)
+        nucleo = np.exp(-0.5 * (deslocamentos / banda_bins) ** 2)
+        densidade = np.convolve(histogramas[codigo], nucleo) / (n * banda_bins * largura * np.sqrt(2 * np.pi))
+        grade = minimo + largura * (np.arange(-raio, BINS_DISTRIBUICAO + raio) + 0.5)
+        pontos = np.linspace(0, len(grade) - 1, PONTOS_CURVA).round().astype('int64')
+
+        linhas_grupo = np.flatnonzero(codigos == codigo)
+        sorteadas = gerador.choice(linhas_grupo, size=min(amostra, n), replace=False)
+        distribuicao.append({
+            'rotulo': rotulo, 'quantidade': int(n), 'media': media,
+            'q1': q1, 'mediana': mediana, 'q3': q3,
+            'cerca_inferior': max(minimo, q1 - 1.5 * (q3 - q1)),
+            'cerca_superior': min(maximo, q3 + 1.5 * (q3 - q1)),
+            'grade': grade[pontos], 'densidade': densidade[pontos],
+            'amostra': valores[sorteadas]
+        })
+    return distribuicao
 
 # Função auxiliar para filtrar dependência administrativa
 def filtrar_dependencia(df, tipo_escola):
@@ -59,24 +836,172 @@ def filtrar_dependencia(df, tipo_escola):
         return df[df['TP_DEPENDENCIA_ADM_ESC'] == 'Privada']
     return df
 
-# Função auxiliar para preparar médias por disciplina
-def preparar_media_disciplinas(df):
-    disciplinas = ['NU_NOTA_MT', 'NU_NOTA_CN', 'NU_NOTA_CH', 'NU_NOTA_LC', 'NU_NOTA_REDACAO']
-    disciplinas_legenda = {
-        'NU_NOTA_MT': 'Matemática',
-        'NU_NOTA_CN': 'Ciências da Natureza',
-        'NU_NOTA_CH': 'Ciências Humanas',
-        'NU_NOTA_LC': 'Linguagens e Códigos',
-        'NU_NOTA_REDACAO': 'Redação',
-        'MEDIA_NOTAS': 'Média Geral'
-    }
+# Agregação única do recorte: soma as células do cubo por faixa etária, sexo, tipo de escola e
+# dependência, com quantidade, soma e soma dos quadrados de cada nota. Pirâmide, roscas e médias saem
+# desse resumo (no máximo algumas centenas de linhas) sem voltar ao cubo
+DIMENSOES_RESUMO = ['TP_FAIXA_ETARIA', 'TP_SEXO', 'TP_ESCOLA', 'TP_DEPENDENCIA_ADM_ESC']
+COLUNAS_AGREGADAS = (
+    ['QUANTIDADE'] + [f'SOMA_{medida}' for medida in MEDIDAS] + [f'SOMA_QUADRADOS_{medida}' for medida in MEDIDAS]
+)
+
+def agregar_selecao(cubo):
+    return cubo.groupby(DIMENSOES_RESUMO, observed=True)[COLUNAS_AGREGADAS].sum().reset_index()
+
+# Quantidade, média e variância de cada nota por uma coluna do resumo
+def estatisticas_por(resumo, coluna):
+    somas = resumo.groupby(coluna, observed=True)[COLUNAS_AGREGADAS].sum()
+    estatisticas = pd.DataFrame({'Quantidade': somas['QUANTIDADE'].astype('int64')})
+    for medida in MEDIDAS:
+        media = somas[f'SOMA_{medida}'] / somas['QUANTIDADE']
+        estatisticas[f'MEDIA_{medida}'] = media
+        estatisticas[f'VARIANCIA_{medida}'] = (somas[f'SOMA_QUADRADOS_{medida}'] / somas['QUANTIDADE'] - media ** 2).clip(lower=0)
+    return estatisticas.reset_index()
+
+# Nome de exibição de cada nota
+LEGENDA_MEDIDAS = {
+    'NU_NOTA_MT': 'Matemática',
+    'NU_NOTA_CN': 'Ciências da Natureza',
+    'NU_NOTA_CH': 'Ciências Humanas',
+    'NU_NOTA_LC': 'Linguagens e Códigos',
+    'NU_NOTA_REDACAO': 'Redação',
+    'MEDIA_NOTAS': 'Média Geral'
+}
+
+# Função auxiliar para preparar médias por disciplina a partir das estatísticas por tipo de escola
+def preparar_media_disciplinas(estatisticas):
+    media_long = estatisticas.melt(id_vars='TP_ESCOLA', value_vars=[f'MEDIA_{medida}' for medida in MEDIDAS],
+                                   var_name='Disciplina', value_name='Média')
+    media_long['Disciplina'] = media_long['Disciplina'].str.removeprefix('MEDIA_').map(LEGENDA_MEDIDAS)
+    return media_long
+
+# Cache LRU com validade opcional (segundos), seguro entre threads e com contadores de uso.
+# Uma instância no módulo é compartilhada por todas as sessões do processo. Cada chave é calculada
+# uma vez: quem pede uma chave em cálculo espera por ele em vez de calcular de novo
+class CacheLRU:
+    def __init__(self, capacidade=256, validade=None):
+        self.capacidade = capacidade
+        self.validade = validade
+        self.acertos = 0
+        self.falhas = 0
+        self.despejos = 0
+        self._itens = OrderedDict()
+        # Chaves em cálculo, com o evento que avisa o fim do cálculo (fora do LRU: não são despejadas)
+        self._em_calculo = {}
+        self._trava = threading.Lock()
+
+    def _valido(self, item):
+        return item is not None and (self.validade is None or time.monotonic() - item[0] < self.validade)
+
+    # Com a trava
+    def _guardar(self, chave, valor):
+        self._itens[chave] = (time.monotonic(), valor)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.capacidade:
+            self._itens.popitem(last=False)
+            self.despejos += 1
+
+    def obter(self, chave, calcular):
+        while True:
+            with self._trava:
+                item = self._itens.get(chave)
+                if self._valido(item):
+                    self._itens.move_to_end(chave)
+                    self.acertos += 1
+                    return item[1]
+                pronto = self._em_calculo.get(chave)
+                if pronto is None:
+                    pronto = self._em_calculo[chave] = threading.Event()
+                    self.falhas += 1
+                    break
+            # Outra thread está calculando: espera e confere de novo (se o cálculo falhou, quem
+            # chegar primeiro calcula outra vez)
+            pronto.wait()
+
+        try:
+            valor = calcular()
+            with self._trava:
+                self._guardar(chave, valor)
+            return valor
+        finally:
+            with self._trava:
+                del self._em_calculo[chave]
+            pronto.set()
+
+    # Guarda um valor já pronto se a chave não está no cache (ou expirou), sem contar acerto nem falha
+    def semear(self, chave, valor):
+        with self._trava:
+            if not self._valido(self._itens.get(chave)):
+                self._guardar(chave, valor)
+
+    def descartar(self, chave):
+        with self._trava:
+            self._itens.pop(chave, None)
+
+    def estatisticas(self):
+        with self._trava:
+            return {
+                'acertos': self.acertos, 'falhas': self.falhas, 'despejos': self.despejos,
+                'itens': len(self._itens), 'capacidade': self.capacidade
+            }
+
+# Versão dos dados de uma edição: muda sempre que as partições são refeitas ou recebem linhas.
+# Com um estado, é a versão das linhas daquela UF, que só muda quando ela recebe linhas: resultados
+# de recortes de outras UFs continuam válidos depois de um incremento
+def versao_edicao(ano=ANO_PADRAO, limite_linhas=None, estado='Todos'):
+    manifesto = garantir_edicao(ano, limite_linhas)
+    if estado == 'Todos':
+        return versao_manifesto(ano, manifesto)
+    return f"{ano}:{manifesto['impressao']}:{manifesto['versoes_uf'].get(estado, 0)}"
+
+# Dados dos gráficos que saem do cubo (pirâmide, roscas e médias por disciplina) para um recorte
+def calcular_resumo_graficos(ano, sexo, escola, estado, municipio, limite_linhas=None):
+    with medir('fatiar_cubo') as registro:
+        cubo = fatiar_cubo(carregar_cubo(ano, limite_linhas), sexo, escola, estado, municipio)
+        anotar(registro, linhas=len(cubo))
+    with medir('agregar') as registro:
+        resumo = agregar_selecao(cubo)
+        estatisticas_escola = estatisticas_por(resumo, 'TP_ESCOLA')
+        dados = {
+            'piramide': contar_piramide(resumo, extras=['TP_ESCOLA']),
+            'escola': estatisticas_escola,
+            'dependencia': estatisticas_por(filtrar_dependencia(resumo, escola), 'TP_DEPENDENCIA_ADM_ESC'),
+            'disciplinas': preparar_media_disciplinas(estatisticas_escola)
+        }
+        anotar(registro, linhas=len(resumo))
+    return dados
+
+# Resumo do violino para um recorte: o único gráfico que precisa das linhas
+def calcular_distribuicao_graficos(ano, sexo, escola, estado, municipio, limite_linhas=None):
+    ufs = None if estado == 'Todos' else [estado]
+    with medir('carregar_dados') as registro:
+        df = carregar_dados(ano, ufs, limite_linhas)
+        anotar(registro, linhas=len(df))
+    with medir('filtrar') as registro:
+        posicoes = selecionar_linhas(carregar_indice(ano, ufs, limite_linhas), sexo, escola, estado, municipio)
+        anotar(registro, linhas=len(df) if posicoes is None else len(posicoes))
+    with medir('distribuicao'):
+        return preparar_distribuicao(df, posicoes)
 
-    media_disciplinas = df.groupby('TP_ESCOLA')[disciplinas].mean()
-    media_geral = df.groupby('TP_ESCOLA')['MEDIA_NOTAS'].mean()
-    media_disciplinas['MEDIA_NOTAS'] = media_geral
-    media_disciplinas = media_disciplinas.reset_index()
+# Dados agregados de todos os gráficos para um recorte da barra lateral
+def calcular_dados_graficos(ano, sexo, escola, estado, municipio, limite_linhas=None):
+    dados = calcular_resumo_graficos(ano, sexo, escola, estado, municipio, limite_linhas)
+    dados['distribuicao'] = calcular_distribuicao_graficos(ano, sexo, escola, estado, municipio, limite_linhas)
+    return dados
 
-    media_long = media_disciplinas.melt(id_vars='TP_ESCOLA', value_vars=disciplinas + ['MEDIA_NOTAS'],
-                                         var_name='Disciplina', value_name='Média')
-    media_long['Disciplina'] = media_long['Disciplina'].map(disciplinas_legenda)
-    return media_long
\ No newline at end of file
+# Particiona todas as edições com CSV: python -m utils.processamento [limite_linhas]
+# Anexa linhas novas a uma edição: python -m utils.processamento anexar <ano> <csv> [<csv> ...]
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == 'anexar':
+        ano = int(sys.argv[2])
+        for caminho in sys.argv[3:]:
+            inicio = time.perf_counter()
+            manifesto = anexar_incremento(ano, caminho)
+            linhas = max(fim for _, fim in manifesto['particoes'].values())
+            print(f"{ano}: {caminho} anexado em {time.perf_counter() - inicio:.1f} s; "
+                  f"{linhas} linhas, versão {manifesto['versao']}")
+        sys.exit()
+    limite = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    for ano in sorted(fontes_csv()):
+        manifesto = particionar_edicao(ano, limite)
+        linhas = max(fim for _, fim in manifesto['particoes'].values())
+        print(f"{ano}: {linhas} linhas em {len(manifesto['particoes'])} partições")
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from streamlit import logger
+
+from utils.graficos import gerar_figuras_painel
+from utils.processamento import (
+    ANO_PADRAO, calcular_dados_graficos, carregar_cubo, construir_opcoes_regiao, garantir_edicao
+)
+
+# Relatórios estáticos por região, sem o servidor do Streamlit:
+#   python -m utils.relatorios [--ano 2023] [--municipios] [--formato html|png] [--processos N] [--saida relatorios]
+# Cada região (UF ou município) gera um HTML com os gráficos do painel (ou um PNG por gráfico).
+# As colunas da edição são mapeadas em memória, então os processos compartilham as mesmas páginas
+DIRETORIO_RELATORIOS = 'relatorios'
+
+# Nome de arquivo seguro para uma região
+def nome_arquivo(texto):
+    return re.sub(r'[^\w-]+', '_', texto).strip('_')
+
+# Inicialização de cada processo: silencia os avisos de cache fora do Streamlit e mapeia a edição
+def iniciar_processo(ano, limite_linhas):
+    logger.set_log_level('error')
+    garantir_edicao(ano, limite_linhas)
+
+# Gera e grava os gráficos de uma região; devolve os arquivos e o tempo de cada etapa
+def gerar_relatorio(ano, estado, municipio, saida, formato='html', limite_linhas=None):
+    inicio = time.perf_counter()
+    graficos = calcular_dados_graficos(ano, 'Todos', 'Todos', estado, municipio, limite_linhas)
+    dados = time.perf_counter()
+    figuras = gerar_figuras_painel(graficos)
+
+    diretorio = os.path.join(saida, str(ano), estado)
+    os.makedirs(diretorio, exist_ok=True)
+    base = os.path.join(diretorio, 'estado' if municipio == 'Todos' else nome_arquivo(municipio))
+    if formato == 'png':
+        arquivos = [f'{base}_{nome}.png' for nome in figuras]
+        for arquivo, figura in zip(arquivos, figuras.values()):
+            figura.write_image(arquivo)
+    else:
+        titulo = estado if municipio == 'Todos' else f'{municipio} ({estado})'
+        arquivos = [f'{base}.html']
+        with open(arquivos[0], 'w', encoding='utf-8') as arquivo:
+            arquivo.write(f'<html><head><meta charset="utf-8"><title>ENEM {ano} - {titulo}</title></head><body>')
+            arquivo.write(f'<h1>ENEM {ano} - {titulo}</h1>')
+            for i, figura in enumerate(figuras.values()):
+                arquivo.write(figura.to_html(full_html=False, include_plotlyjs='cdn' if i == 0 else False))
+            arquivo.write('</body></html>')
+    fim = time.perf_counter()
+    return {
+        'estado': estado, 'municipio': municipio, 'arquivos': arquivos,
+        'segundos_dados': round(dados - inicio, 4), 'segundos_figuras': round(fim - dados, 4),
+        'segundos': round(fim - inicio, 4)
+    }
+
+# Regiões do relatório: todas as UFs e, opcionalmente, todos os municípios de cada UF
+def listar_regioes(ano, municipios=False, limite_linhas=None):
+    ufs, municipios_por_uf = construir_opcoes_regiao(carregar_cubo(ano, limite_linhas))
+    regioes = [(uf, 'Todos') for uf in ufs]
+    if municipios:
+        regioes += [(uf, municipio) for uf in ufs for municipio in municipios_por_uf[uf]]
+    return regioes
+
+# Distribui as regiões no pool e registra cada resultado em <saida>/<ano>/indice.jsonl assim que
+# fica pronto. Devolve o resumo de vazão
+def gerar_relatorios(ano=ANO_PADRAO, municipios=False, saida=DIRETORIO_RELATORIOS, formato='html',
+                     processos=None, limite_linhas=None):
+    logger.set_log_level('error')
+    inicio = time.perf_counter()
+    garantir_edicao(ano, limite_linhas)
+    regioes = listar_regioes(ano, municipios, limite_linhas)
+    os.makedirs(os.path.join(saida, str(ano)), exist_ok=True)
+
+    tempos = []
+    with ProcessPoolExecutor(max_workers=processos, initializer=iniciar_processo,
+                             initargs=(ano, limite_linhas)) as pool, \
+            open(os.path.join(saida, str(ano), 'indice.jsonl'), 'w', encoding='utf-8') as indice:
+        tarefas = [
+            pool.submit(gerar_relatorio, ano, estado, municipio, saida, formato, limite_linhas)
+            for estado, municipio in regioes
+        ]
+        for concluidas, tarefa in enumerate(as_completed(tarefas), start=1):
+            resultado = tarefa.result()
+            indice.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+            indice.flush()
+            tempos.append(resultado['segundos'])
+            print(f"[{concluidas}/{len(tarefas)}] {resultado['estado']} {resultado['municipio']}: "
+                  f"{resultado['segundos']:.2f} s")
+
+    total = time.perf_counter() - inicio
+    return {
+        'regioes': len(tempos), 'segundos': round(total, 2),
+        'regioes_por_segundo': round(len(tempos) / total, 2) if total else None,
+        'segundos_por_regiao_medio': round(sum(tempos) / len(tempos), 4) if tempos else None,
+        'segundos_por_regiao_maximo': max(tempos, default=None)
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Relatórios estáticos do painel por região')
+    parser.add_argument('--ano', type=int, default=ANO_PADRAO)
+    parser.add_argument('--municipios', action='store_true', help='gera também um relatório por município')
+    parser.add_argument('--formato', choices=['html', 'png'], default='html', help='png requer o pacote kaleido')
+    parser.add_argument('--processos', type=int, default=None)
+    parser.add_argument('--saida', default=DIRETORIO_RELATORIOS)
+    parser.add_argument('--limite-linhas', type=int, default=None)
+    argumentos = parser.parse_args()
+    resumo = gerar_relatorios(
+        argumentos.ano, argumentos.municipios, argumentos.saida, argumentos.formato,
+        argumentos.processos, argumentos.limite_linhas
+    )
+    print(json.dumps(resumo, ensure_ascii=False))